@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+
+SIZES = (1000, 5000, 10000, 50000)
+ZONES = ('eu-west-2a', 'eu-west-2b', 'eu-west-2c')
+TYPES = ('t3.medium', 'm5.large', 'm5.xlarge', 'c5.2xlarge')
+TEAMS = ('platform', 'data', 'web')
+REPEATS = 3
+
+# Only client construction touches boto3; nothing here calls AWS
+os.environ.setdefault('AWS_REGION', 'eu-west-2')
+os.environ.setdefault('KEYED_GROUPS', 'az,type,ami,tag:team')
+os.environ['API_RATE_LIMIT'] = '0'
+os.environ['INVENTORY_HISTORY'] = 'false'
+
+from dynamic_inventory import Ec2Inventory, InstanceRecord, np
+
+class BenchInventory(Ec2Inventory):
+    def _verify_bastion_connection(self):
+        pass
+
+def synthetic_fleet(size):
+    return {
+        f"i-{i:017x}": InstanceRecord(
+            instance_id=f"i-{i:017x}",
+            private_ip=f"10.{i // 65536}.{(i // 256) % 256}.{i % 256}",
+            public_ip='',
+            az=ZONES[i % len(ZONES)],
+            launch_time=1.7e9 + i,
+            image_id=f"ami-{i % 8:017x}",
+            instance_type=TYPES[i % len(TYPES)],
+            tags=(('role', 'Master' if i < 3 else 'Worker'), ('team', TEAMS[i % len(TEAMS)]))
+        )
+        for i in range(size)
+    }
+
+def timed(inventory, mode, instances):
+    # Best of REPEATS full generation passes; the columnar side includes
+    # building the FleetTable, as it does on every refresh
+    inventory.columnar_mode = mode
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        inventory._generate_fresh_inventory(dict(instances))
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    if np is None:
+        sys.exit("NumPy is required for the columnar benchmark")
+
+    inventory = BenchInventory('203.0.113.10', '203.0.113.20', '', 'https://oidc.example.com',
+                               '123456789012', 'k8s-node', 'example.com', cluster_name='bench')
+    if not inventory.keyed_groups:
+        sys.exit("KEYED_GROUPS must name at least one rule; without them the loop is always used")
+
+    print(f"KEYED_GROUPS={os.environ['KEYED_GROUPS']}")
+    print(f"{'hosts':>8} {'loop ms':>9} {'columnar ms':>12} {'speedup':>8}")
+    for size in SIZES:
+        instances = synthetic_fleet(size)
+        loop_ms = timed(inventory, 'off', instances)
+        columnar_ms = timed(inventory, 'on', instances)
+        print(f"{size:>8} {loop_ms:>9.1f} {columnar_ms:>12.1f} {loop_ms / columnar_ms:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,1130 @@
 #!/usr/bin/env python3
+import argparse
+import asyncio
+import base64
+import contextvars
+import hashlib
+import fcntl
 import json
+import mmap
 import os
+import random
 import time
 import sys
 import subprocess
+import threading
+import re
+import shlex
+import shutil
+import sqlite3
+import struct
+import tempfile
+import zlib
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from itertools import chain, zip_longest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import jinja2
+    import yaml
+except ImportError:
+    jinja2 = yaml = None
+
+K8S_ROLES = ('master', 'worker')
+CLUSTER_TAG_PREFIX = "kubernetes.io/cluster/"
+CLUSTER_FIELDS = ('master_ip', 'bastion_ip', 'worker_asg', 'issuer_url', 'account_id', 'role_name', 'domain')
+KEYED_GROUP_SOURCES = {'az': 'az', 'type': 'instance_type', 'ami': 'image_id'}
+DIFF_FIELDS = ('private_ip', 'public_ip', 'az', 'image_id', 'instance_type')
+# Re-measured on every probe; they say nothing about the fleet having changed
+PROBE_FIELDS = ('reachable', 'ssh_rtt_ms')
+HOSTVAR_KEYS = ('private_ip', 'public_ip', 'tags', '_meta')
+JOIN_PARAM_KEYS = ('kubeadm_join_command', 'kubeadm_join_endpoint', 'join_token', 'master_ca_hash', 'join_token_expires_at')
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+@dataclass(slots=True)
+class InstanceRecord:
+    # Compact per-host record; tag keys/values and repeated fields (AZ, AMI,
+    # type) are interned so large fleets share one copy of each string.
+    instance_id: str
+    private_ip: str
+    public_ip: str
+    az: str
+    launch_time: float
+    image_id: str
+    instance_type: str
+    tags: tuple
+    region: str = ''
+    account: str = ''
+    # Hostvars added after collection (probe results, enrichment)
+    extra: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_hostvars(cls, hostvars):
+        meta = hostvars.get('_meta', {})
+        return cls(
+            instance_id=meta.get('id', ''),
+            private_ip=hostvars.get('private_ip', ''),
+            public_ip=hostvars.get('public_ip', ''),
+            az=_intern(meta.get('az', '')),
+            launch_time=meta.get('launch_time', 0.0),
+            image_id=_intern(meta.get('image_id', '')),
+            instance_type=_intern(meta.get('type', '')),
+            tags=tuple((_intern(k), _intern(v)) for k, v in hostvars.get('tags', {}).items()),
+            region=_intern(meta.get('region', '')),
+            account=_intern(meta.get('account', '')),
+            extra={k: v for k, v in hostvars.items() if k not in HOSTVAR_KEYS}
+        )
+
+    @property
+    def role(self):
+        return self.tag('role').lower()
+
+    def tag(self, key, default=''):
+        for tag_key, tag_value in self.tags:
+            if tag_key == key:
+                return tag_value
+        return default
+
+    def to_hostvars(self):
+        return {
+            **self.extra,
+            "private_ip": self.private_ip,
+            "public_ip": self.public_ip,
+            "tags": dict(self.tags),
+            "_meta": {
+                "az": self.az,
+                "launch_time": self.launch_time,
+                "image_id": self.image_id,
+                "id": self.instance_id,
+                "type": self.instance_type,
+                "region": self.region,
+                "account": self.account
+            }
+        }
+
+def group_records_by_role(records):
+    groups = {}
+    for record in records:
+        role = record.role
+        if role in K8S_ROLES:
+            groups.setdefault(role, []).append(record)
+    return groups
+
+def safe_group_name(*parts):
+    return re.sub(r'[^A-Za-z0-9_]', '_', '_'.join(parts)).lower()
+
+class KeyedGroupRules:
+    # Compiled from KEYED_GROUPS, e.g. "az,type,ami,tag:team"
+    def __init__(self, spec):
+        self.rules = []
+        for token in filter(None, (t.strip() for t in spec.split(','))):
+            if token.startswith('tag:') and len(token) > 4:
+                key = _intern(token[4:].lower())
+                self.rules.append((safe_group_name('tag', key), None, key))
+            elif token in KEYED_GROUP_SOURCES:
+                self.rules.append((token, KEYED_GROUP_SOURCES[token], None))
+            else:
+                print(f"Ignoring unknown keyed group rule: {token}", file=sys.stderr)
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def groups_for(self, record):
+        for prefix, column, tag_key in self.rules:
+            value = getattr(record, column) if column else record.tag(tag_key)
+            if value:
+                yield safe_group_name(prefix, value)
+
+    def columnar_groups(self, table, mask):
+        groups = {}
+        tag_rules = []
+        for prefix, column, tag_key in self.rules:
+            if column is None:
+                tag_rules.append((prefix, tag_key))
+                continue
+            for value, indices in table.group_by(column, mask).items():
+                if value:
+                    groups.setdefault(safe_group_name(prefix, value), []).extend(table.take(indices))
+        for record in table.take(np.flatnonzero(mask)) if tag_rules else ():
+            for prefix, tag_key in tag_rules:
+                value = record.tag(tag_key)
+                if value:
+                    groups.setdefault(safe_group_name(prefix, value), []).append(record)
+        return groups
+
+class FleetTable:
+    # Columnar view of the collected fleet (requires NumPy). Categorical
+    # columns are stored as integer codes, so membership, filters and derived
+    # groups are array operations instead of per-host branches.
+    CATEGORICAL = ('role', 'az', 'instance_type', 'image_id')
+
+    def __init__(self, records):
+        self.records = list(records)
+        count = len(self.records)
+        self.instance_id = np.array([r.instance_id for r in self.records], dtype=object)
+        self.private_ip = np.array([r.private_ip for r in self.records], dtype=object)
+        self.launch_time = np.fromiter((r.launch_time for r in self.records), dtype=np.float64, count=count)
+        self.categories = {}
+        self.codes = {}
+        for column in self.CATEGORICAL:
+            values = (r.tag('role') for r in self.records) if column == 'role' else (
+                getattr(r, column) for r in self.records)
+            lookup = {}
+            self.codes[column] = np.fromiter(
+                (lookup.setdefault(v, len(lookup)) for v in values), dtype=np.int32, count=count)
+            self.categories[column] = list(lookup)
+        # Roles are lowercased per distinct value, not per host
+        lowered = {}
+        remap = np.array([lowered.setdefault(c.lower(), len(lowered)) for c in self.categories['role']],
+                         dtype=np.int32)
+        if len(remap):
+            self.codes['role'] = remap[self.codes['role']]
+        self.categories['role'] = list(lowered)
+
+    def __len__(self):
+        return len(self.records)
+
+    def mask(self, column, values):
+        wanted = set(values)
+        if column in self.codes:
+            codes = [i for i, value in enumerate(self.categories[column]) if value in wanted]
+            return np.isin(self.codes[column], codes)
+        return np.isin(getattr(self, column), list(wanted))
+
+    def launched_after(self, timestamp):
+        return self.launch_time > timestamp
+
+    def take(self, indices):
+        return [self.records[i] for i in indices]
+
+    def group_by(self, column, mask=None):
+        indices = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        if not len(indices):
+            return {}
+        codes = self.codes[column][indices]
+        counts = np.bincount(codes, minlength=len(self.categories[column]))
+        chunks = np.split(indices[np.argsort(codes, kind='stable')], np.cumsum(counts)[:-1])
+        return {
+            self.categories[column][code]: chunk
+            for code, chunk in enumerate(chunks)
+            if len(chunk)
+        }
+
+    def role_groups(self):
+        return {
+            role: self.take(indices)
+            for role, indices in self.group_by('role', self.mask('role', K8S_ROLES)).items()
+        }
+
+def parse_max_unavailable(value, total):
+    value = str(value).strip()
+    if value.endswith('%'):
+        count = int(total * float(value[:-1]) // 100)
+    else:
+        count = int(value)
+    return max(1, count)
+
+def plan_rolling_batches(records, max_unavailable):
+    zones = {}
+    for record in sorted(records, key=lambda r: (r.launch_time, r.instance_id)):
+        zones.setdefault(record.az, deque()).append(record)
+    # A batch may never take every node of a multi-node zone
+    zone_caps = {az: max(1, len(members) - 1) for az, members in zones.items()}
+
+    batches = []
+    while any(zones.values()):
+        batch = []
+        taken = dict.fromkeys(zones, 0)
+        progress = True
+        while progress and len(batch) < max_unavailable:
+            progress = False
+            # Round-robin across zones, largest remaining zone first
+            for az in sorted(zones, key=lambda z: (-len(zones[z]), z)):
+                if len(batch) >= max_unavailable:
+                    break
+                if zones[az] and taken[az] < zone_caps[az]:
+                    batch.append(zones[az].popleft())
+                    taken[az] += 1
+                    progress = True
+        batches.append(batch)
+    return batches
+
+def shard_inventory(inventory, shard_count, master_shard=1):
+    hostvars = inventory.get('_meta', {}).get('hostvars', {})
+    masters = set(inventory.get('k8s_master', {}).get('hosts', {}))
+    zones = {}
+    for host in sorted(hostvars):
+        if host not in masters:
+            zones.setdefault(hostvars[host].get('_meta', {}).get('az', ''), []).append(host)
+
+    # Deal hosts AZ-interleaved onto the least loaded shard, breaking ties
+    # by per-AZ load; masters are pinned to master_shard and count towards it
+    assignments = [set() for _ in range(shard_count)]
+    assignments[min(max(master_shard, 1), shard_count) - 1].update(masters & hostvars.keys())
+    zone_loads = [dict() for _ in range(shard_count)]
+    interleaved = zip_longest(*([(az, h) for h in zones[az]] for az in sorted(zones)), fillvalue=(None, None))
+    for az, host in chain.from_iterable(interleaved):
+        if host is None:
+            continue
+        index = min(range(shard_count), key=lambda i: (len(assignments[i]), zone_loads[i].get(az, 0)))
+        assignments[index].add(host)
+        zone_loads[index][az] = zone_loads[index].get(az, 0) + 1
+
+    shards = []
+    for members in assignments:
+        shard = {}
+        for name, group in inventory.items():
+            if name == '_meta':
+                shard[name] = {"hostvars": {host: hostvars[host] for host in sorted(members)}}
+            elif 'hosts' in group:
+                shard[name] = {**group, "hosts": {h: v for h, v in group['hosts'].items() if h in members}}
+            else:
+                shard[name] = group
+        shards.append(shard)
+    return shards
+
+def parse_shard(value):
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard index must be within 1..{count}")
+    return index, count
+
+def parse_time(value):
+    # Epoch seconds or ISO-8601; naive times are taken as UTC
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected epoch seconds or ISO-8601 time, got {value!r}")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+def parse_join_command(output):
+    # "kubeadm join <endpoint> --token <t> --discovery-token-ca-cert-hash sha256:<h>"
+    parts = output.split()
+    if len(parts) < 3 or parts[:2] != ['kubeadm', 'join']:
+        return {}
+    options = dict(zip(parts[3::2], parts[4::2]))
+    if '--token' not in options or '--discovery-token-ca-cert-hash' not in options:
+        return {}
+    return {
+        "kubeadm_join_command": ' '.join(parts),
+        "kubeadm_join_endpoint": parts[2],
+        "join_token": options['--token'],
+        "master_ca_hash": options['--discovery-token-ca-cert-hash'].split(':', 1)[-1]
+    }
+
+def strip_join_params(inventory):
+    worker = (inventory or {}).get("k8s_worker")
+    if not worker or not any(key in worker.get("vars", {}) for key in JOIN_PARAM_KEYS):
+        return inventory
+    worker_vars = {key: value for key, value in worker["vars"].items() if key not in JOIN_PARAM_KEYS}
+    return {**inventory, "k8s_worker": {**worker, "vars": worker_vars}}
+
+def join_token_expired(inventory, now=None):
+    expires_at = (inventory or {}).get("k8s_worker", {}).get("vars", {}).get("join_token_expires_at")
+    return expires_at is not None and expires_at <= (time.time() if now is None else now)
+
+def records_from_inventory(inventory):
+    hostvars = (inventory or {}).get('_meta', {}).get('hostvars', {})
+    records = (InstanceRecord.from_hostvars(host) for host in hostvars.values())
+    return {record.instance_id: record for record in records}
+
+def asg_in_service(groups):
+    return {
+        instance['InstanceId']
+        for group in groups
+        for instance in group.get('Instances', [])
+        if instance.get('LifecycleState') == 'InService'
+    }
+
+def _diff_summary(record):
+    return {"id": record.instance_id, "private_ip": record.private_ip, "role": record.role, "az": record.az}
+
+def diff_records(previous, current):
+    changed = []
+    for instance_id in sorted(previous.keys() & current.keys()):
+        old, new = previous[instance_id], current[instance_id]
+        fields = {
+            field: [getattr(old, field), getattr(new, field)]
+            for field in DIFF_FIELDS
+            if getattr(old, field) != getattr(new, field)
+        }
+        if dict(old.tags) != dict(new.tags):
+            fields["tags"] = [dict(old.tags), dict(new.tags)]
+        if fields:
+            changed.append({**_diff_summary(new), "fields": fields})
+    return {
+        "added": [_diff_summary(current[i]) for i in sorted(current.keys() - previous.keys())],
+        "removed": [_diff_summary(previous[i]) for i in sorted(previous.keys() - current.keys())],
+        "changed": changed
+    }
+
+def _chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+class Enricher(ABC):
+    # One batched API sweep for the whole fleet, returning hostvars keyed by
+    # instance ID. Filters are chunked to stay within EC2's value limits.
+    name = ''
+    filter_chunk = 200
+
+    @abstractmethod
+    def fetch(self, ec2_client, instance_ids):
+        pass
+
+class StatusEnricher(Enricher):
+    name = 'status'
+
+    def fetch(self, ec2_client, instance_ids):
+        wanted = set(instance_ids)
+        results = {}
+        paginator = ec2_client.get_paginator('describe_instance_status')
+        for page in paginator.paginate(
+            Filters=[{'Name': 'instance-state-name', 'Values': ['running']}],
+            PaginationConfig={'PageSize': 1000}
+        ):
+            for status in page['InstanceStatuses']:
+                if status['InstanceId'] in wanted:
+                    results[status['InstanceId']] = {
+                        "ec2_system_status": status.get('SystemStatus', {}).get('Status', 'unknown'),
+                        "ec2_instance_status": status.get('InstanceStatus', {}).get('Status', 'unknown')
+                    }
+        return results
+
+class VolumeEnricher(Enricher):
+    name = 'volumes'
+
+    def fetch(self, ec2_client, instance_ids):
+        results = {instance_id: {"ebs_volumes": []} for instance_id in instance_ids}
+        paginator = ec2_client.get_paginator('describe_volumes')
+        for chunk in _chunks(instance_ids, self.filter_chunk):
+            for page in paginator.paginate(Filters=[{'Name': 'attachment.instance-id', 'Values': chunk}]):
+                for volume in page['Volumes']:
+                    for attachment in volume.get('Attachments', []):
+                        if attachment['InstanceId'] in results:
+                            results[attachment['InstanceId']]["ebs_volumes"].append({
+                                "volume_id": volume['VolumeId'],
+                                "device": attachment.get('Device', ''),
+                                "size_gib": volume.get('Size', 0),
+                                "type": volume.get('VolumeType', ''),
+                                "encrypted": volume.get('Encrypted', False)
+                            })
+        return results
+
+class NetworkInterfaceEnricher(Enricher):
+    name = 'network_interfaces'
+
+    def fetch(self, ec2_client, instance_ids):
+        results = {instance_id: {"network_interfaces": []} for instance_id in instance_ids}
+        paginator = ec2_client.get_paginator('describe_network_interfaces')
+        for chunk in _chunks(instance_ids, self.filter_chunk):
+            for page in paginator.paginate(Filters=[{'Name': 'attachment.instance-id', 'Values': chunk}]):
+                for eni in page['NetworkInterfaces']:
+                    attachment = eni.get('Attachment', {})
+                    if attachment.get('InstanceId') in results:
+                        results[attachment['InstanceId']]["network_interfaces"].append({
+                            "id": eni['NetworkInterfaceId'],
+                            "device_index": attachment.get('DeviceIndex', 0),
+                            "private_ip": eni.get('PrivateIpAddress', ''),
+                            "subnet_id": eni.get('SubnetId', ''),
+                            "security_groups": [group['GroupId'] for group in eni.get('Groups', [])]
+                        })
+        return results
+
+class InstanceProfileEnricher(Enricher):
+    name = 'instance_profile'
+
+    def fetch(self, ec2_client, instance_ids):
+        results = {}
+        paginator = ec2_client.get_paginator('describe_iam_instance_profile_associations')
+        for chunk in _chunks(instance_ids, self.filter_chunk):
+            for page in paginator.paginate(Filters=[
+                {'Name': 'instance-id', 'Values': chunk},
+                {'Name': 'state', 'Values': ['associated']}
+            ]):
+                for association in page['IamInstanceProfileAssociations']:
+                    results[association['InstanceId']] = {
+                        "iam_instance_profile_arn": association.get('IamInstanceProfile', {}).get('Arn', '')
+                    }
+        return results
+
+ENRICHERS = {cls.name: cls for cls in (StatusEnricher, VolumeEnricher, NetworkInterfaceEnricher, InstanceProfileEnricher)}
+
+class EnrichmentPipeline:
+    def __init__(self, enrichers):
+        self.enrichers = enrichers
+
+    @classmethod
+    def from_names(cls, names):
+        enrichers = []
+        for name in names:
+            if name in ENRICHERS:
+                enrichers.append(ENRICHERS[name]())
+            else:
+                print(f"Ignoring unknown enricher: {name}", file=sys.stderr)
+        return cls(enrichers)
+
+    def __bool__(self):
+        return bool(self.enrichers)
+
+    def run(self, ec2_client, instances, required=()):
+        # Failing enrichers are reported and skipped, except those in
+        # required, which make the refresh incomplete
+        instance_ids = sorted(instances)
+        if not instance_ids:
+            return
+        with ThreadPoolExecutor(max_workers=len(self.enrichers)) as pool:
+            futures = {pool.submit(_in_context(e.fetch), ec2_client, instance_ids): e for e in self.enrichers}
+        for future, enricher in futures.items():
+            try:
+                results = future.result()
+            except (ClientError, BotoCoreError, KeyError) as e:
+                print(f"Enricher {enricher.name} error: {e}", file=sys.stderr)
+                if enricher.name in required:
+                    _collection_error(f"enricher {enricher.name} failed")
+                continue
+            for instance_id, hostvars in results.items():
+                if instance_id in instances:
+                    instances[instance_id].extra.update(hostvars)
+
+def recommend_kubelet_sizing(vcpus, memory_mib, max_enis, ipv4_per_eni, pod_network='flannel'):
+    if pod_network == 'vpc-cni' and max_enis and ipv4_per_eni:
+        # VPC CNI pod density is bounded by ENI secondary addresses
+        max_pods = max_enis * (ipv4_per_eni - 1) + 2
+    else:
+        # Overlay networks (Flannel's /24 per node): scale with memory
+        max_pods = max(16, memory_mib // 128)
+    max_pods = min(max_pods, 110 if vcpus < 30 else 250)
+
+    # CPU: 6% of the first core, 1% of the second, 0.5% of the next two,
+    # 0.25% of the rest; memory: 255Mi plus 11Mi per pod
+    cpu_millicores = 0
+    remaining = vcpus
+    for cores, share in ((1, 0.06), (1, 0.01), (2, 0.005), (max(vcpus - 4, 0), 0.0025)):
+        cpu_millicores += min(max(remaining, 0), cores) * 1000 * share
+        remaining -= cores
+    memory_reserved = 255 + 11 * max_pods
+    # OS daemons (systemd, sshd, journald): 100m plus 25m per core past
+    # the second, 100Mi plus 1% of memory, both capped
+    system_cpu = min(500, 100 + 25 * max(vcpus - 2, 0))
+    system_memory = min(1024, 100 + memory_mib // 100)
+    eviction_memory = max(100, min(1024, memory_mib // 20))
+    return {
+        "kubelet_max_pods": max_pods,
+        "kubelet_kube_reserved_cpu": f"{max(int(cpu_millicores), 60)}m",
+        "kubelet_kube_reserved_memory": f"{memory_reserved}Mi",
+        "kubelet_system_reserved_cpu": f"{system_cpu}m",
+        "kubelet_system_reserved_memory": f"{system_memory}Mi",
+        "kubelet_eviction_memory_available": f"{eviction_memory}Mi"
+    }
+
+class InstanceTypeCatalog:
+    # Long-lived local cache of describe_instance_types; only types missing
+    # from (or expired in) the catalog cost an API call
+    def __init__(self, cache, ec2_client, ttl=604800, pod_network='flannel'):
+        self.cache = cache
+        self.ec2_client = ec2_client
+        self.ttl = ttl
+        self.pod_network = pod_network
+        self.path = os.path.join(cache.cache_dir, "instance_types.json")
+        self.types = cache.read_json(self.path) or {}
+
+    def lookup(self, instance_types):
+        now = time.time()
+        missing = sorted(
+            t for t in set(instance_types)
+            if t and now - self.types.get(t, {}).get('fetched_at', 0) >= self.ttl
+        )
+        if missing:
+            self._fetch(missing, now)
+        return {t: self.types[t] for t in instance_types if t in self.types}
+
+    def _fetch(self, instance_types, now):
+        try:
+            paginator = self.ec2_client.get_paginator('describe_instance_types')
+            for chunk in _chunks(instance_types, 100):
+                for page in paginator.paginate(InstanceTypes=chunk):
+                    for info in page['InstanceTypes']:
+                        network = info.get('NetworkInfo', {})
+                        self.types[info['InstanceType']] = {
+                            "vcpus": info.get('VCpuInfo', {}).get('DefaultVCpus', 0),
+                            "memory_mib": info.get('MemoryInfo', {}).get('SizeInMiB', 0),
+                            "max_enis": network.get('MaximumNetworkInterfaces', 0),
+                            "ipv4_per_eni": network.get('Ipv4AddressesPerInterface', 0),
+                            "fetched_at": now
+                        }
+        except (ClientError, BotoCoreError) as e:
+            print(f"Instance type lookup error: {e}", file=sys.stderr)
+            return
+        self.cache.write_json(self.path, self.types)
+
+    def annotate(self, records):
+        catalog = self.lookup({record.instance_type for record in records})
+        for record in records:
+            info = catalog.get(record.instance_type)
+            if not info:
+                continue
+            record.extra["node_vcpus"] = info["vcpus"]
+            record.extra["node_memory_mib"] = info["memory_mib"]
+            record.extra["node_max_enis"] = info["max_enis"]
+            record.extra.update(recommend_kubelet_sizing(
+                info["vcpus"], info["memory_mib"], info["max_enis"], info["ipv4_per_eni"], self.pod_network))
+
+class CacheFormatError(ValueError):
+    pass
+
+class InventoryCacheFile:
+    # Binary inventory cache: a fixed header (magic, schema version,
+    # validation time, section table checksum) and a section table pointing
+    # at separately zlib-compressed JSON sections. The file is mmapped and a
+    # section is only checked and inflated when first asked for.
+    MAGIC = b'KINV'
+    SCHEMA_VERSION = 2
+    SECTIONS = ('groups', 'hostvars', 'all_vars', 'tiers')
+    HEADER = struct.Struct('<4sHHdI')
+    ENTRY = struct.Struct('<16sQQI')
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise CacheFormatError(f"{path} is empty")
+        self._sections = {}
+        try:
+            self._read_header(path)
+        except Exception:
+            self._map.close()
+            raise
+
+    def _read_header(self, path):
+        if len(self._map) < self.HEADER.size:
+            raise CacheFormatError(f"{path} is truncated")
+        magic, version, count, self.validated_at, table_crc = self.HEADER.unpack_from(self._map)
+        if magic != self.MAGIC:
+            raise CacheFormatError(f"{path} is not an inventory cache")
+        if version != self.SCHEMA_VERSION:
+            raise CacheFormatError(f"{path} has schema version {version}, expected {self.SCHEMA_VERSION}")
+        table = self._map[self.HEADER.size:self.HEADER.size + count * self.ENTRY.size]
+        if len(table) != count * self.ENTRY.size or zlib.crc32(table) != table_crc:
+            raise CacheFormatError(f"{path} has a corrupt section table")
+        self._table = {}
+        for name, offset, length, crc in self.ENTRY.iter_unpack(table):
+            if offset + length > len(self._map):
+                raise CacheFormatError(f"{path} is truncated")
+            self._table[name.rstrip(b'\0').decode()] = (offset, length, crc)
+
+    def section(self, name):
+        if name not in self._sections:
+            offset, length, crc = self._table[name]
+            payload = self._map[offset:offset + length]
+            if zlib.crc32(payload) != crc:
+                raise CacheFormatError(f"section {name} failed its checksum")
+            self._sections[name] = json.loads(zlib.decompress(payload))
+        return self._sections[name]
+
+    def group(self, name):
+        return self.section('groups').get(name)
+
+    def host(self, private_ip):
+        return self.section('hostvars').get(private_ip)
+
+    def inventory(self):
+        groups = self.section('groups')
+        return {
+            **groups,
+            "_meta": {"hostvars": self.section('hostvars')},
+            "all": {**groups.get("all", {}), "vars": self.section('all_vars')}
+        }
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @classmethod
+    def pack(cls, inventory, validated_at, tiers=None):
+        groups = {name: group for name, group in inventory.items() if name not in ("_meta", "all")}
+        all_group = {key: value for key, value in inventory.get("all", {}).items() if key != "vars"}
+        if all_group:
+            groups["all"] = all_group
+        payloads = [
+            zlib.compress(json.dumps(section, separators=(',', ':')).encode())
+            for section in (
+                groups,
+                inventory.get("_meta", {}).get("hostvars", {}),
+                inventory.get("all", {}).get("vars", {}),
+                tiers or {}
+            )
+        ]
+        offset = cls.HEADER.size + len(cls.SECTIONS) * cls.ENTRY.size
+        table = b''
+        for name, payload in zip(cls.SECTIONS, payloads):
+            table += cls.ENTRY.pack(name.encode(), offset, len(payload), zlib.crc32(payload))
+            offset += len(payload)
+        header = cls.HEADER.pack(cls.MAGIC, cls.SCHEMA_VERSION, len(cls.SECTIONS), validated_at, zlib.crc32(table))
+        return header + table + b''.join(payloads)
 
 class CacheManager:
-    def __init__(self, cache_ttl=300):
-        self.cache_dir = "/tmp/ansible_cache"
-        self.cache_file = os.path.join(self.cache_dir, "inventory_cache.json")
+    def __init__(self, cache_ttl=300, suffix='', ttl_floor=None, ttl_ceiling=None, control_plane_ttl=None,
+                 cache_dir="/tmp/ansible_cache"):
+        self.cache_dir = cache_dir
+        self.cache_file = os.path.join(self.cache_dir, f"inventory_cache{suffix}.bin")
+        self.diff_file = os.path.join(self.cache_dir, f"inventory_diff{suffix}.json")
+        self.ttl_file = os.path.join(self.cache_dir, f"inventory_ttl{suffix}.json")
+        if not suffix:
+            self.diff_file = os.environ.get('INVENTORY_DIFF_FILE', self.diff_file)
         self.cache_ttl = cache_ttl
+        self.ttl_floor = cache_ttl if ttl_floor is None else ttl_floor
+        self.ttl_ceiling = cache_ttl if ttl_ceiling is None else ttl_ceiling
+        self.control_plane_ttl = self.ttl_ceiling if control_plane_ttl is None else control_plane_ttl
         self._ensure_cache_dir()
 
     def _ensure_cache_dir(self):
         os.makedirs(self.cache_dir, exist_ok=True)
         os.chmod(self.cache_dir, 0o700)
 
+    def current_ttl(self):
+        return (self.read_json(self.ttl_file) or {}).get("ttl", self.cache_ttl)
+
+    def adapt_ttl(self, activities=0, capacity_gap=0, churn=0):
+        # Quiet refreshes double the TTL towards the ceiling; scaling
+        # activity and host churn divide it down, and an ASG still
+        # converging on its desired capacity drops it to the floor
+        previous = self.current_ttl()
+        if capacity_gap:
+            ttl = self.ttl_floor
+        elif activities or churn:
+            ttl = previous / (1 + activities + churn)
+        else:
+            ttl = previous * 2
+        ttl = int(min(self.ttl_ceiling, max(self.ttl_floor, ttl)))
+        self.write_json(self.ttl_file, {
+            "ttl": ttl,
+            "activities": activities,
+            "capacity_gap": capacity_gap,
+            "churn": churn,
+            "computed_at": time.time()
+        })
+        return ttl
+
+    def open_cache(self):
+        try:
+            return InventoryCacheFile(self.cache_file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Cache read warning: {e}", file=sys.stderr)
+            return None
+
+    def tier_ttls(self):
+        # Masters (and all.vars, which is rebuilt with them) hardly change;
+        # the worker tier follows the adaptive TTL
+        return {"master": self.control_plane_ttl, "worker": self.current_ttl()}
+
+    def read_tiers(self):
+        cache_file = self.open_cache()
+        if cache_file is None:
+            return {}
+        with cache_file:
+            try:
+                return cache_file.section('tiers')
+            except Exception as e:
+                print(f"Cache read warning: {e}", file=sys.stderr)
+                return {}
+
+    def stale_tiers(self, tiers=None):
+        now = time.time()
+        tiers = self.read_tiers() if tiers is None else tiers
+        return {role for role, ttl in self.tier_ttls().items() if now - tiers.get(role, 0) >= ttl}
+
     def read_cache(self):
+        # Snapshot and tiers from one open of the file
+        cache_file = self.open_cache()
+        if cache_file is None:
+            return None, {}
+        with cache_file:
+            try:
+                return cache_file.inventory(), cache_file.section('tiers')
+            except Exception as e:
+                print(f"Cache read warning: {e}", file=sys.stderr)
+                return None, {}
+
+    def read_snapshot(self):
+        # Last written inventory regardless of TTL, used as the diff baseline
+        cache_file = self.open_cache()
+        if cache_file is None:
+            return None
+        with cache_file:
+            try:
+                return cache_file.inventory()
+            except Exception as e:
+                print(f"Cache read warning: {e}", file=sys.stderr)
+                return None
+
+    def read_json(self, path):
         try:
-            if os.path.exists(self.cache_file):
-                if time.time() - os.path.getmtime(self.cache_file) < self.cache_ttl:
-                    with open(self.cache_file, 'r') as f:
-                        return json.load(f)
+            with open(path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
         except Exception as e:
             print(f"Cache read warning: {e}", file=sys.stderr)
-        return None
+            return None
 
-    def write_cache(self, data):
+    def write_cache(self, data, tiers=None):
+        now = time.time()
+        tiers = tiers or {role: now for role in K8S_ROLES}
+        self.write_bytes(self.cache_file, InventoryCacheFile.pack(data, now, tiers))
+
+    def write_diff(self, diff):
+        self.write_json(self.diff_file, diff)
+
+    def write_json(self, path, data):
+        self.write_bytes(path, json.dumps(data).encode())
+
+    def write_bytes(self, path, payload):
         try:
-            temp_file = self.cache_file + ".tmp"
-            with open(temp_file, 'w') as f:
-                json.dump(data, f)
-            os.replace(temp_file, self.cache_file)
-            os.chmod(self.cache_file, 0o600)
+            temp_file = path + ".tmp"
+            # Created 0600 up front: some of these files hold credentials
+            with os.fdopen(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+                f.write(payload)
+            os.replace(temp_file, path)
+            os.chmod(path, 0o600)
         except Exception as e:
             print(f"Cache write warning: {e}", file=sys.stderr)
 
+class InventoryHistory:
+    # Every complete refresh as a compressed snapshot, with its hosts
+    # indexed so past host sets can be served or queried without AWS
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS snapshots ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT, taken_at REAL NOT NULL, digest TEXT NOT NULL, inventory BLOB NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS snapshots_taken_at ON snapshots (taken_at)",
+        "CREATE TABLE IF NOT EXISTS hosts ("
+        " snapshot_id INTEGER NOT NULL REFERENCES snapshots (id) ON DELETE CASCADE,"
+        " instance_id TEXT, private_ip TEXT, role TEXT, az TEXT, image_id TEXT, instance_type TEXT, launch_time REAL)",
+        "CREATE INDEX IF NOT EXISTS hosts_snapshot ON hosts (snapshot_id)",
+        "CREATE INDEX IF NOT EXISTS hosts_image ON hosts (image_id, snapshot_id)",
+        "CREATE INDEX IF NOT EXISTS hosts_launch_time ON hosts (launch_time, snapshot_id)",
+    )
+    HOST_COLUMNS = ('instance_id', 'private_ip', 'role', 'az', 'image_id', 'instance_type', 'launch_time')
+
+    def __init__(self, path, retention_days=30):
+        self.path = path
+        self.retention = retention_days * 86400
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        with self.db:
+            for statement in self.SCHEMA:
+                self.db.execute(statement)
+
+    def record(self, inventory, taken_at=None):
+        taken_at = time.time() if taken_at is None else taken_at
+        payload = json.dumps(inventory, sort_keys=True, separators=(',', ':')).encode()
+        digest = self._digest(inventory)
+        with self.db:
+            latest = self.db.execute("SELECT id, digest FROM snapshots ORDER BY taken_at DESC LIMIT 1").fetchone()
+            if latest and latest[1] == digest:
+                # Unchanged since the last snapshot, which already answers
+                # any --as-of from then until now
+                return latest[0]
+            snapshot_id = self.db.execute(
+                "INSERT INTO snapshots (taken_at, digest, inventory) VALUES (?, ?, ?)",
+                (taken_at, digest, zlib.compress(payload))
+            ).lastrowid
+            self.db.executemany(
+                "INSERT INTO hosts (snapshot_id, instance_id, private_ip, role, az, image_id, instance_type, launch_time)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (snapshot_id, record.instance_id, record.private_ip, record.role, record.az,
+                     record.image_id, record.instance_type, record.launch_time)
+                    for record in records_from_inventory(inventory).values()
+                ]
+            )
+            if self.retention > 0:
+                self.db.execute(
+                    "DELETE FROM snapshots WHERE taken_at < ? AND id != ?",
+                    (taken_at - self.retention, snapshot_id)
+                )
+        return snapshot_id
+
+    @staticmethod
+    def _digest(inventory):
+        hostvars = {
+            host: {key: value for key, value in hostvar.items() if key not in PROBE_FIELDS}
+            for host, hostvar in inventory.get("_meta", {}).get("hostvars", {}).items()
+        }
+        stable = {**inventory, "_meta": {**inventory.get("_meta", {}), "hostvars": hostvars}}
+        return hashlib.sha256(json.dumps(stable, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+    def snapshot_id(self, as_of=None):
+        if as_of is None:
+            row = self.db.execute("SELECT id FROM snapshots ORDER BY taken_at DESC LIMIT 1").fetchone()
+        else:
+            row = self.db.execute(
+                "SELECT id FROM snapshots WHERE taken_at <= ? ORDER BY taken_at DESC LIMIT 1", (as_of,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def inventory(self, snapshot_id):
+        row = self.db.execute("SELECT inventory FROM snapshots WHERE id = ?", (snapshot_id,)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def snapshots(self):
+        return [
+            {"id": snapshot_id, "taken_at": taken_at, "hosts": hosts}
+            for snapshot_id, taken_at, hosts in self.db.execute(
+                "SELECT s.id, s.taken_at, COUNT(h.instance_id) FROM snapshots s"
+                " LEFT JOIN hosts h ON h.snapshot_id = s.id GROUP BY s.id ORDER BY s.taken_at"
+            )
+        ]
+
+    def hosts(self, snapshot_id, launched_since=None, image_id=None):
+        query = f"SELECT {', '.join(self.HOST_COLUMNS)} FROM hosts WHERE snapshot_id = ?"
+        params = [snapshot_id]
+        if launched_since is not None:
+            query += " AND launch_time >= ?"
+            params.append(launched_since)
+        if image_id:
+            query += " AND image_id = ?"
+            params.append(image_id)
+        return [dict(zip(self.HOST_COLUMNS, row)) for row in self.db.execute(query + " ORDER BY launch_time", params)]
+
+    def close(self):
+        self.db.close()
+
+def history_path(cache, cluster_name=None):
+    suffix = f"_{cluster_name}" if cluster_name is not None else ''
+    return os.path.join(cache.cache_dir, f"inventory_history{suffix}.sqlite")
+
+class StsCredentialCache:
+    # Assumed-role credentials shared across runs, kept until shortly
+    # before they expire
+    def __init__(self, cache, refresh_margin=300):
+        self.cache = cache
+        self.refresh_margin = refresh_margin
+        self.path = os.path.join(cache.cache_dir, "sts_credentials.json")
+
+    def credentials(self, targets):
+        now = time.time()
+        cached = {
+            role_arn: creds
+            for role_arn, creds in (self.cache.read_json(self.path) or {}).items()
+            if creds.get('expires_at', 0) - self.refresh_margin > now
+        }
+        missing = [(account, role_arn) for account, role_arn in targets if role_arn not in cached]
+        if missing:
+            sts_client = boto3.client('sts')
+            with ThreadPoolExecutor(max_workers=len(missing)) as pool:
+                assumed = pool.map(lambda target: self._assume(sts_client, *target), missing)
+                for (_, role_arn), creds in zip(missing, assumed):
+                    if creds:
+                        cached[role_arn] = creds
+            self.cache.write_json(self.path, cached)
+        return {account: cached[role_arn] for account, role_arn in targets if role_arn in cached}
+
+    def _assume(self, sts_client, account, role_arn):
+        try:
+            response = sts_client.assume_role(RoleArn=role_arn, RoleSessionName=f"dynamic-inventory-{account}")
+        except (ClientError, BotoCoreError) as e:
+            print(f"AssumeRole {role_arn} failed: {e}", file=sys.stderr)
+            return None
+        credentials = response['Credentials']
+        return {
+            "access_key_id": credentials['AccessKeyId'],
+            "secret_access_key": credentials['SecretAccessKey'],
+            "session_token": credentials['SessionToken'],
+            "expires_at": credentials['Expiration'].timestamp()
+        }
+
+def parse_assume_role_targets(value):
+    # "111111111111=arn:aws:iam::111111111111:role/inventory,..."
+    targets = []
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        account, _, role_arn = item.partition('=')
+        if not role_arn:
+            print(f"Ignoring assume-role target without role ARN: {item}", file=sys.stderr)
+            continue
+        targets.append((account.strip(), role_arn.strip()))
+    return targets
+
+class RateLimiter:
+    # Token bucket per account/region/API action, shared by every inventory
+    # process through a locked state file. Throttling halves an action's
+    # rate; each success creeps it back towards the configured ceiling.
+    THROTTLE_CODES = {'RequestLimitExceeded', 'Throttling', 'ThrottlingException', 'TooManyRequestsException'}
+
+    def __init__(self, path, default_rate=10.0, burst=20.0, rates=None, min_rate=0.5):
+        self.path = path
+        self.default_rate = default_rate
+        self.burst = burst
+        self.rates = rates or {}
+        self.min_rate = min_rate
+
+    @contextmanager
+    def _state(self):
+        with os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600), 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                state = json.loads(f.read() or '{}')
+            except ValueError:
+                state = {}
+            yield state
+            f.seek(0)
+            f.truncate()
+            json.dump(state, f)
+
+    def _bucket(self, state, key, action):
+        now = time.time()
+        ceiling = self.rates.get(action, self.default_rate)
+        bucket = state.setdefault(key, {"rate": ceiling, "tokens": self.burst, "updated": now})
+        bucket["tokens"] = min(self.burst, bucket["tokens"] + (now - bucket["updated"]) * bucket["rate"])
+        bucket["updated"] = now
+        return bucket, ceiling
+
+    def acquire(self, key, action):
+        while True:
+            with self._state() as state:
+                bucket, _ = self._bucket(state, key, action)
+                if bucket["tokens"] >= 1:
+                    bucket["tokens"] -= 1
+                    return
+                wait = (1 - bucket["tokens"]) / bucket["rate"]
+            time.sleep(wait * random.uniform(1.0, 1.5))
+
+    def record(self, key, action, throttled):
+        with self._state() as state:
+            bucket, ceiling = self._bucket(state, key, action)
+            if throttled:
+                bucket["rate"] = max(self.min_rate, bucket["rate"] / 2)
+            else:
+                bucket["rate"] = min(ceiling, bucket["rate"] + ceiling / 20)
+
+    def attach(self, client, scope):
+        service = client.meta.service_model.service_name
+
+        def before_attempt(event_name, **kwargs):
+            action = event_name.rsplit('.', 1)[-1]
+            self.acquire(f"{scope}/{action}", action)
+
+        def after_attempt(event_name, response=None, **kwargs):
+            action = event_name.rsplit('.', 1)[-1]
+            code = (response[1].get('Error', {}).get('Code') if response else None)
+            self.record(f"{scope}/{action}", action, code in self.THROTTLE_CODES)
+
+        # request-created and needs-retry fire once per attempt, retries included
+        client.meta.events.register(f"request-created.{service}", before_attempt)
+        client.meta.events.register_first(f"needs-retry.{service}", after_attempt)
+
+def parse_rate_limits(value):
+    # "DescribeInstances=5,DescribeInstanceStatus=2"
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        action, _, rate = item.partition('=')
+        rates[action.strip()] = float(rate)
+    return rates
+
+# Standard retry mode backs off exponentially with full jitter; the read
+# timeout bounds how long an in-flight call can outlive REFRESH_DEADLINE
+CLIENT_CONFIG = Config(
+    retries={'mode': 'standard', 'max_attempts': int(os.environ.get('AWS_MAX_ATTEMPTS', '8'))},
+    connect_timeout=5,
+    read_timeout=int(os.environ.get('AWS_READ_TIMEOUT', '20'))
+)
+
+class RefreshDeadlineExceeded(Exception):
+    pass
+
+class RefreshRun:
+    # One refresh attempt: its own deadline, errors and ASG snapshot. The
+    # request-created hook checks the run of the calling thread, so a sweep
+    # abandoned at its deadline stops at its next request and never feeds
+    # a later refresh.
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.deadline = time.monotonic() + budget if budget else None
+        self.errors = []
+        self.asg_groups = []
+
+    def check(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise RefreshDeadlineExceeded(f"refresh deadline of {self.budget:g}s exceeded")
+
+_REFRESH_RUN = contextvars.ContextVar('refresh_run', default=None)
+
+def _check_refresh_run(**kwargs):
+    run = _REFRESH_RUN.get()
+    if run is not None:
+        run.check()
+
+def _collection_error(message):
+    run = _REFRESH_RUN.get()
+    if run is not None:
+        run.errors.append(message)
+
+def _in_context(func):
+    # Pool threads start with an empty context; carry the caller's refresh
+    # run into each call
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(func, *args)
+
+class RegionClients:
+    def __init__(self, region, account='', credentials=None, rate_limiter=None):
+        self.region = region
+        self.account = account
+        if credentials:
+            session = boto3.session.Session(
+                aws_access_key_id=credentials['access_key_id'],
+                aws_secret_access_key=credentials['secret_access_key'],
+                aws_session_token=credentials['session_token'],
+                region_name=region
+            )
+            self.ec2 = session.client('ec2', config=CLIENT_CONFIG)
+            self.asg = session.client('autoscaling', config=CLIENT_CONFIG)
+        else:
+            self.ec2 = boto3.client('ec2', region_name=region, config=CLIENT_CONFIG)
+            self.asg = boto3.client('autoscaling', region_name=region, config=CLIENT_CONFIG)
+        for client in (self.ec2, self.asg):
+            client.meta.events.register_first('request-created', _check_refresh_run)
+            if rate_limiter:
+                rate_limiter.attach(client, f"{account}/{region}")
+        self.ec2_paginator = self.ec2.get_paginator('describe_instances')
+
 class Ec2Inventory:
-    def __init__(self, master_public_ip, bastion_public_ip, worker_asg_name, issuer_url, account_id, role_name, domain):
-        self.cluster_tag = f"kubernetes.io/cluster/{os.environ.get('CLUSTER_NAME', '')}"
+    def __init__(self, master_public_ip, bastion_public_ip, worker_asg_name, issuer_url, account_id, role_name, domain,
+                 cluster_name=None):
+        self.cluster_name = cluster_name if cluster_name is not None else os.environ.get('CLUSTER_NAME', '')
+        self.cluster_tag = f"{CLUSTER_TAG_PREFIX}{self.cluster_name}"
         self.bastion_public_ip = bastion_public_ip
         self.asg_name = worker_asg_name
         self.issuer_url = issuer_url
@@ -50,19 +1134,154 @@ class Ec2Inventory:
         self.ssh_key_path = os.path.expanduser(os.environ.get('SSH_KEY_PATH', '~/.ssh/deployer'))
         self.common_args = self._build_ssh_args()
         self.region = os.environ.get('AWS_REGION', 'eu-west-2')
-        self.ec2_client = boto3.client('ec2', region_name=self.region)
-        self.asg_client = boto3.client('autoscaling', region_name=self.region)
-        self.ec2_paginator = self.ec2_client.get_paginator('describe_instances')
-        self.cache = CacheManager(cache_ttl=int(os.environ.get('CACHE_TTL', '300')))
-        self._verify_bastion_connection()
+        # AWS_REGIONS adds regions collected concurrently; AWS_REGION stays the
+        # primary region (ASG, bastions, instance-type catalog)
+        self.regions = list(dict.fromkeys(
+            [self.region] + [r.strip() for r in os.environ.get('AWS_REGIONS', '').split(',') if r.strip()]
+        ))
+        self.cache = CacheManager(
+            cache_ttl=int(os.environ.get('CACHE_TTL', '300')),
+            ttl_floor=int(os.environ.get('CACHE_TTL_FLOOR', '60')),
+            ttl_ceiling=int(os.environ.get('CACHE_TTL_CEILING', '3600')),
+            control_plane_ttl=int(os.environ.get('CACHE_TTL_CONTROL_PLANE', '21600')),
+            suffix=f"_{cluster_name}" if cluster_name is not None else ''
+        )
+        self.history = None
+        if os.environ.get('INVENTORY_HISTORY', 'true').lower() == 'true':
+            self.history = InventoryHistory(
+                history_path(self.cache, cluster_name),
+                retention_days=int(os.environ.get('INVENTORY_HISTORY_DAYS', '30'))
+            )
+        # Client pools per (account, region): the ambient credentials cover
+        # this account, ASSUME_ROLE_TARGETS adds accounts via cached STS roles
+        self.primary = (self.account_id, self.region)
+        self.rate_limiter = None
+        if float(os.environ.get('API_RATE_LIMIT', '10')) > 0:
+            self.rate_limiter = RateLimiter(
+                os.path.join(self.cache.cache_dir, "rate_limits.json"),
+                default_rate=float(os.environ.get('API_RATE_LIMIT', '10')),
+                burst=float(os.environ.get('API_RATE_BURST', '20')),
+                rates=parse_rate_limits(os.environ.get('API_RATE_LIMITS', ''))
+            )
+        self.clients = {
+            (self.account_id, region): RegionClients(region, self.account_id, rate_limiter=self.rate_limiter)
+            for region in self.regions
+        }
+        self.assume_targets = parse_assume_role_targets(os.environ.get('ASSUME_ROLE_TARGETS', ''))
+        self.sts_cache = StsCredentialCache(self.cache)
+        self.assumed_expiry = {}
+        self.unassumed_accounts = []
+        self._assume_role_clients()
+        # Budget for the AWS collection phase of a refresh; past it every
+        # further API request of that refresh fails fast
+        self.refresh_deadline = float(os.environ.get('REFRESH_DEADLINE', '90'))
+        self.collection_errors = []
+        self.ec2_client = self.clients[self.primary].ec2
+        self.asg_client = self.clients[self.primary].asg
+        self.ec2_paginator = self.clients[self.primary].ec2_paginator
+        self.columnar_mode = os.environ.get('INVENTORY_COLUMNAR', 'auto').lower()
+        self.columnar_min_hosts = int(os.environ.get('COLUMNAR_MIN_HOSTS', '2000'))
+        self.keyed_groups = KeyedGroupRules(os.environ.get('KEYED_GROUPS', ''))
+        self.worker_max_unavailable = os.environ.get('WORKER_BATCH_MAX_UNAVAILABLE', '')
+        self.probe_hosts = os.environ.get('PROBE_HOSTS', '').lower() in ('1', 'true', 'yes')
+        self.probe_workers = int(os.environ.get('PROBE_WORKERS', '32'))
+        self.probe_timeout = int(os.environ.get('PROBE_TIMEOUT', '5'))
+        self.probe_deadline = float(os.environ.get('PROBE_DEADLINE', '30'))
+        self.exclude_impaired = os.environ.get('EXCLUDE_IMPAIRED', '').lower() in ('1', 'true', 'yes')
+        enrichers = [name.strip() for name in os.environ.get('INVENTORY_ENRICHERS', '').split(',') if name.strip()]
+        # Excluding impaired hosts needs their status, whichever way it was asked for
+        check_status = os.environ.get('CHECK_INSTANCE_STATUS', '').lower() in ('1', 'true', 'yes')
+        if (check_status or self.exclude_impaired) and 'status' not in enrichers:
+            enrichers.append('status')
+        self.enrichment = EnrichmentPipeline.from_names(enrichers)
+        self.instance_types = None
+        if os.environ.get('INSTANCE_TYPE_CATALOG', '').lower() in ('1', 'true', 'yes'):
+            self.instance_types = InstanceTypeCatalog(
+                self.cache,
+                self.ec2_client,
+                ttl=int(os.environ.get('INSTANCE_TYPE_CACHE_TTL', '604800')),
+                pod_network=os.environ.get('POD_NETWORK', 'flannel')
+            )
+        self.fetch_join_params = os.environ.get('FETCH_JOIN_PARAMS', '').lower() in ('1', 'true', 'yes')
+        self.join_token_ttl = int(os.environ.get('JOIN_TOKEN_TTL', '7200'))
+        # Cached parameters must expire well before the token itself, and
+        # early enough that an inventory cached at the TTL ceiling still
+        # carries a live token
+        self.join_cache_ttl = max(0, min(
+            int(os.environ.get('JOIN_CACHE_TTL', '3600')),
+            self.join_token_ttl // 2,
+            self.join_token_ttl - self.cache.ttl_ceiling
+        ))
+        self.fact_cache_dir = os.environ.get('FACT_CACHE_DIR', '')
+        self.watch_min_interval = float(os.environ.get('WATCH_MIN_INTERVAL', '10'))
+        self.watch_max_interval = float(os.environ.get('WATCH_MAX_INTERVAL', '120'))
+        self.last_diff = None
+        self.bastions = []
+        if os.environ.get('BASTION_DISCOVERY', '').lower() in ('1', 'true', 'yes'):
+            self._select_bastions()
+        else:
+            self._verify_bastion_connection()
 
-    def _build_ssh_args(self):
+    def _build_ssh_args(self, bastion_ip=None):
         return (
             f"-o StrictHostKeyChecking=no "
             f"-o UserKnownHostsFile=/dev/null "
-            f"-o ProxyCommand='ssh -W %h:%p -i {self.ssh_key_path} ubuntu@{self.bastion_public_ip}'"
+            f"-o ProxyCommand='ssh -W %h:%p -i {self.ssh_key_path} ubuntu@{bastion_ip or self.bastion_public_ip}'"
+        )
+
+    def _select_bastions(self):
+        candidates = self._discover_bastions()
+        with ThreadPoolExecutor(max_workers=max(1, len(candidates))) as pool:
+            latencies = list(pool.map(self._measure_bastion, candidates))
+        # Healthy bastions, fastest first
+        self.bastions = sorted(
+            ((record, rtt_ms) for record, rtt_ms in zip(candidates, latencies) if rtt_ms is not None),
+            key=lambda item: item[1]
+        )
+        if not self.bastions:
+            raise SystemExit(f"No reachable bastion among {len(candidates)} discovered")
+        self.bastion_public_ip = self.bastions[0][0].public_ip
+        self.common_args = self._build_ssh_args()
+
+    def _discover_bastions(self):
+        bastions = []
+        try:
+            for page in self.ec2_paginator.paginate(
+                Filters=[
+                    {'Name': f'tag:{self.cluster_tag}', 'Values': ['shared', 'owned']},
+                    {'Name': 'tag:Role', 'Values': [os.environ.get('BASTION_ROLE_TAG', 'bastion')]},
+                    {'Name': 'instance-state-name', 'Values': ['running']}
+                ]
+            ):
+                for reservation in page['Reservations']:
+                    for instance in reservation['Instances']:
+                        record = self._format_instance(instance, self.region, self.account_id)
+                        if record.public_ip:
+                            bastions.append(record)
+        except ClientError as e:
+            print(f"Bastion discovery error: {e}", file=sys.stderr)
+        if self.bastion_public_ip and all(b.public_ip != self.bastion_public_ip for b in bastions):
+            # Keep the bastion passed on the command line as a candidate
+            bastions.append(InstanceRecord('', '', self.bastion_public_ip, '', 0.0, '', '', ()))
+        return bastions
+
+    def _measure_bastion(self, bastion):
+        return self._timed_ssh(
+            ["ssh", "-q", "-o", "BatchMode=yes", "-o", f"ConnectTimeout={self.probe_timeout}",
+             "-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null",
+             "-i", self.ssh_key_path, f"ubuntu@{bastion.public_ip}", "exit"]
         )
 
+    def _assign_bastions(self, records):
+        by_az = {}
+        for bastion, _ in self.bastions:
+            by_az.setdefault(bastion.az, bastion)
+        for record in records:
+            # Same-AZ bastion when healthy, otherwise the fastest one
+            bastion = by_az.get(record.az, self.bastions[0][0])
+            record.extra["bastion_ip"] = bastion.public_ip
+            record.extra["ansible_ssh_common_args"] = self._build_ssh_args(bastion.public_ip)
+
     def _verify_bastion_connection(self):
         max_retries = 3
         for attempt in range(max_retries):
@@ -80,33 +1299,313 @@ class Ec2Inventory:
                     raise SystemExit(f"Bastion connection failed after {max_retries} attempts: {e}")
                 time.sleep(5)
 
-    def get_inventory(self):
-        cached_data = self.cache.read_cache()
-        if cached_data and not self._cache_invalid(cached_data):
+    def _probe_hosts(self, records):
+        # Bounded by PROBE_DEADLINE as a whole. Hosts not probed by then are
+        # left unknown (reachable: null), not reported unreachable.
+        pool = ThreadPoolExecutor(max_workers=max(1, self.probe_workers))
+        futures = [pool.submit(self._probe_host, record) for record in records]
+        wait(futures, timeout=self.probe_deadline if self.probe_deadline > 0 else None)
+        pool.shutdown(wait=False, cancel_futures=True)
+        unreachable = []
+        unprobed = 0
+        for record, future in zip(records, futures):
+            if not future.done() or future.cancelled():
+                unprobed += 1
+                record.extra["reachable"] = None
+                record.extra["ssh_rtt_ms"] = None
+                continue
+            rtt_ms = future.result()
+            record.extra["reachable"] = rtt_ms is not None
+            record.extra["ssh_rtt_ms"] = rtt_ms
+            if rtt_ms is None:
+                unreachable.append(record)
+        if unprobed:
+            print(f"Host probe deadline of {self.probe_deadline:g}s reached; {unprobed} of {len(records)} "
+                  f"hosts left unprobed", file=sys.stderr)
+        return unreachable
+
+    def _probe_host(self, record):
+        common_args = record.extra.get("ansible_ssh_common_args", self.common_args)
+        return self._timed_ssh([
+            "ssh", "-q", "-o", "BatchMode=yes", "-o", f"ConnectTimeout={self.probe_timeout}",
+            *shlex.split(common_args), "-i", self.ssh_key_path, f"ubuntu@{record.private_ip}", "exit"
+        ])
+
+    def _timed_ssh(self, command):
+        start = time.monotonic()
+        try:
+            subprocess.run(
+                command,
+                check=True,
+                timeout=self.probe_timeout * 2,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            return None
+        return round((time.monotonic() - start) * 1000, 1)
+
+    def _assume_role_clients(self):
+        # Builds clients for ASSUME_ROLE_TARGETS accounts whenever their
+        # cached credentials are renewed. Accounts that could not be assumed
+        # make every refresh incomplete rather than silently missing.
+        if not self.assume_targets:
+            return
+        credentials = self.sts_cache.credentials(self.assume_targets)
+        self.unassumed_accounts = [account for account, _ in self.assume_targets if account not in credentials]
+        for account, creds in credentials.items():
+            if self.assumed_expiry.get(account) == creds['expires_at']:
+                continue
+            self.assumed_expiry[account] = creds['expires_at']
+            for region in self.regions:
+                self.clients[(account, region)] = RegionClients(region, account, creds, self.rate_limiter)
+
+    def get_inventory(self, instances=None):
+        cached_data = self.cached_inventory()
+        if cached_data:
             return cached_data
-        
-        fresh_data = self._generate_fresh_inventory()
-        self.cache.write_cache(fresh_data)
+        return self.refresh_inventory(instances, roles=self.stale_tiers, previous=self.cached_snapshot)
+
+    def cached_inventory(self):
+        # Tier timestamps and the groups (for join token expiry) are checked
+        # before hostvars are inflated. The snapshot is inflated once, to be
+        # served or kept in cached_snapshot as the refresh baseline.
+        self.stale_tiers = set(K8S_ROLES)
+        self.cached_snapshot = (None, {})
+        cache_file = self.cache.open_cache()
+        if cache_file is None:
+            return None
+        with cache_file:
+            try:
+                tiers = cache_file.section('tiers')
+                self.stale_tiers = self._stale_tiers(cache_file.section('groups'), tiers)
+                self.cached_snapshot = (cache_file.inventory(), tiers)
+            except (ValueError, KeyError, zlib.error) as e:
+                print(f"Cache read warning: {e}", file=sys.stderr)
+                self.stale_tiers = set(K8S_ROLES)
+                return None
+        return None if self.stale_tiers else self.cached_snapshot[0]
+
+    def refresh_inventory(self, instances=None, roles=K8S_ROLES, keep_new_nodes=False, previous=None):
+        # previous is the (snapshot, tiers) pair already read from the cache
+        previous_data, previous_tiers = previous if previous is not None else self.cache.read_cache()
+        run = RefreshRun(self.refresh_deadline if self.refresh_deadline > 0 else None)
+        self.collection_errors = run.errors
+        result = {}
+        roles = set(roles or K8S_ROLES)
+        # Only expired tiers are re-collected; the rest are rebuilt from the
+        # snapshot. A prefetched sweep or a missing snapshot covers everything.
+        if instances is not None or previous_data is None:
+            roles = set(K8S_ROLES)
+        tiers = {role: time.time() for role in roles}
+        tiers.update({role: previous_tiers[role] for role in K8S_ROLES if role not in roles and role in previous_tiers})
+
+        def collect():
+            _REFRESH_RUN.set(run)
+            try:
+                collected = instances
+                # instances may be prefetched by a multi-cluster sweep
+                if collected is not None:
+                    self._add_asg_instances(collected)
+                elif roles != set(K8S_ROLES):
+                    collected = {
+                        instance_id: record
+                        for instance_id, record in records_from_inventory(previous_data).items()
+                        if record.role not in roles
+                    }
+                    collected.update(self._collect_instances(roles))
+                else:
+                    collected = self._collect_instances()
+                self._describe_instances(collected)
+                result["instances"] = collected
+            except RefreshDeadlineExceeded as e:
+                run.errors.append(str(e))
+            except Exception as e:
+                print(f"Inventory collection error: {e!r}", file=sys.stderr)
+                run.errors.append(f"collection failed: {e}")
+
+        run.errors.extend(f"AssumeRole failed for account {account}" for account in self.unassumed_accounts)
+        if not run.errors:
+            # Only the AWS collection runs against REFRESH_DEADLINE; the SSH
+            # phases of generation carry their own timeouts
+            worker = threading.Thread(target=collect, daemon=True)
+            worker.start()
+            worker.join(run.budget)
+            if worker.is_alive():
+                run.errors.append(f"collection still running after {run.budget:g}s deadline")
+
+        # A partial inventory would drop hosts from the cache, so it is
+        # never persisted; the last complete one is served instead
+        if run.errors or "instances" not in result:
+            return self._last_known_good(previous_data)
+        if self.asg_name:
+            # ASG membership the worker tier was built from, so scale-in is
+            # noticed as well as scale-out
+            if 'worker' in roles:
+                tiers["asg_members"] = sorted(asg_in_service(run.asg_groups))
+            elif "asg_members" in previous_tiers:
+                tiers["asg_members"] = previous_tiers["asg_members"]
+        fresh_data = self._generate_fresh_inventory(result["instances"])
+        diff = self._apply_diff(fresh_data, previous_data, keep_new_nodes)
+        self.last_diff = diff
+        self.cache.write_cache(fresh_data, tiers)
+        if self.history:
+            # Join tokens are short-lived secrets; history keeps none
+            try:
+                self.history.record(strip_join_params(fresh_data))
+            except sqlite3.Error as e:
+                print(f"Inventory history warning: {e}", file=sys.stderr)
+        self.cache.adapt_ttl(**self._scaling_signals(diff, run))
         return fresh_data
 
-    def _cache_invalid(self, cached_data):
+    def _last_known_good(self, previous_data):
+        for error in self.collection_errors:
+            print(f"Inventory refresh incomplete: {error}", file=sys.stderr)
+        if previous_data is None:
+            raise SystemExit("Inventory refresh incomplete and no last-known-good cache to serve")
+        print(f"Serving last-known-good inventory from {self.cache.cache_file}", file=sys.stderr)
+        if join_token_expired(previous_data):
+            print("Dropping expired join parameters from the last-known-good inventory", file=sys.stderr)
+            return strip_join_params(previous_data)
+        return previous_data
+
+    def watch(self, out=sys.stdout):
+        # Polls until interrupted. Workers are re-collected on every poll,
+        # masters only once their tier expires. Quiet or failed polls back
+        # the interval off towards WATCH_MAX_INTERVAL; any change snaps it
+        # back. Assumed-role clients are renewed before each poll.
+        interval = self.watch_min_interval
+        synced = False
+        while True:
+            self.last_diff = None
+            failure = None
+            diff = None
+            try:
+                self._assume_role_clients()
+                if not synced:
+                    inventory = self.get_inventory()
+                    self._emit(out, "sync", hosts=[
+                        _diff_summary(record) for record in records_from_inventory(inventory).values()
+                    ])
+                    synced = True
+                else:
+                    previous = self.cache.read_cache()
+                    self.refresh_inventory(roles=self.cache.stale_tiers(previous[1]) | {'worker'},
+                                           keep_new_nodes=True, previous=previous)
+                    diff = self.last_diff
+                    if diff is None:
+                        failure = list(self.collection_errors)
+            except (Exception, SystemExit) as e:
+                failure = [str(e)]
+
+            if failure is not None:
+                self._emit(out, "refresh_failed", errors=failure)
+                interval = min(self.watch_max_interval, interval * 2)
+            elif diff is not None:
+                changes = [
+                    (kind, host)
+                    for kind in ("added", "removed", "changed")
+                    for host in diff[kind]
+                ]
+                for kind, host in changes:
+                    self._emit(out, kind, **host)
+                interval = self.watch_min_interval if changes else min(self.watch_max_interval, interval * 2)
+            time.sleep(interval)
+
+    def _emit(self, out, event, **fields):
+        print(json.dumps({"event": event, "at": time.time(), **fields}), file=out, flush=True)
+
+    def _apply_diff(self, inventory, previous_inventory, keep_new_nodes=False):
+        diff = diff_records(records_from_inventory(previous_inventory), records_from_inventory(inventory))
+        diff["generated_at"] = time.time()
+        diff["baseline"] = previous_inventory is None
+        self.cache.write_diff(diff)
+
+        # A baseline run has nothing to compare with; every host, masters
+        # included, would otherwise count as new
+        added = {} if diff["baseline"] else {host["private_ip"]: {} for host in diff["added"]}
+        if keep_new_nodes and previous_inventory:
+            # Watch polls carry earlier additions forward, so new_nodes still
+            # covers everything since the last regular refresh
+            hostvars = inventory["_meta"]["hostvars"]
+            carried = previous_inventory.get("new_nodes", {}).get("hosts", {})
+            added = {**{host: {} for host in carried if host in hostvars}, **added}
+        inventory["new_nodes"] = {"hosts": added, "vars": {}}
+        # Removed hosts are no longer reachable, so they are listed as data
+        # rather than hosts to keep them out of `all`
+        inventory["removed_nodes"] = {"hosts": {}, "vars": {"removed_hosts": diff["removed"]}}
+        return diff
+
+    def _scaling_signals(self, diff, run):
+        signals = {
+            "activities": 0,
+            "capacity_gap": 0,
+            "churn": 0 if diff["baseline"] else len(diff["added"]) + len(diff["removed"])
+        }
+        if not self.asg_name:
+            return signals
+        since = (self.cache.read_json(self.cache.ttl_file) or {}).get("computed_at", time.time() - self.cache.ttl_ceiling)
         try:
-            asg_info = self.asg_client.describe_auto_scaling_groups(
+            activities = self.asg_client.describe_scaling_activities(
+                AutoScalingGroupName=self.asg_name, MaxRecords=20
+            )['Activities']
+        except (ClientError, BotoCoreError) as e:
+            print(f"Scaling activity lookup error: {e}", file=sys.stderr)
+            activities = []
+        signals["activities"] = sum(1 for activity in activities if activity['StartTime'].timestamp() > since)
+        in_progress = sum(
+            1 for activity in activities
+            if activity.get('StatusCode') not in ('Successful', 'Failed', 'Cancelled')
+        )
+        in_service_gap = sum(
+            abs(group['DesiredCapacity'] - sum(
+                1 for instance in group.get('Instances', []) if instance.get('LifecycleState') == 'InService'
+            ))
+            for group in run.asg_groups
+        )
+        signals["capacity_gap"] = in_progress + in_service_gap
+        return signals
+
+    def _stale_tiers(self, cached_data, tiers):
+        if cached_data is None:
+            return set(K8S_ROLES)
+        stale = self.cache.stale_tiers(tiers)
+        if 'worker' not in stale and (join_token_expired(cached_data) or self._workers_changed(tiers)):
+            stale.add('worker')
+        return stale
+
+    def _workers_changed(self, tiers):
+        # ASG membership moving on, in either direction, ahead of the worker
+        # TTL invalidates the worker tier only; the control plane stays cached
+        if not self.asg_name:
+            return False
+        try:
+            groups = self.asg_client.describe_auto_scaling_groups(
                 AutoScalingGroupNames=[self.asg_name]
-            )
-            asg_update_time = asg_info['AutoScalingGroups'][0]['LastModifiedTime'].timestamp()
-            
-            cache_time = os.path.getmtime(self.cache.cache_file)
-            return asg_update_time > cache_time or any(
-                instance['_meta']['launch_time'] > cache_time
-                for group in cached_data.values()
-                for instance in group.get('hosts', {}).values()
-            )
-        except Exception as e:
+            )['AutoScalingGroups']
+        except (ClientError, BotoCoreError) as e:
             print(f"Cache validation error: {e}", file=sys.stderr)
             return True
+        return "asg_members" not in tiers or set(tiers["asg_members"]) != asg_in_service(groups)
+
+    def _describe_instances(self, instances):
+        # Every AWS lookup beyond the sweep itself, so generation afterwards
+        # needs nothing but the records
+        if self.enrichment:
+            # Without statuses, EXCLUDE_IMPAIRED would quietly keep impaired hosts
+            required = ('status',) if self.exclude_impaired else ()
+            by_target = {}
+            for instance_id, record in instances.items():
+                by_target.setdefault(self._target_of(record), {})[instance_id] = record
+            with ThreadPoolExecutor(max_workers=len(by_target) or 1) as pool:
+                list(pool.map(
+                    _in_context(lambda item: self.enrichment.run(self.clients[item[0]].ec2, item[1], required)),
+                    by_target.items()
+                ))
+        if self.instance_types:
+            self.instance_types.annotate(instances.values())
 
-    def _generate_fresh_inventory(self):
+    def _generate_fresh_inventory(self, instances):
         inventory = {
             "k8s_master": {"hosts": {}, "vars": {}},
             "k8s_worker": {"hosts": {}, "vars": {}},
@@ -133,56 +1632,222 @@ class Ec2Inventory:
                     "ansible_ssh_common_args": self.common_args,
                     "ansible_ssh_private_key_file": self.ssh_key_path,
                     "irsa_enabled": True,
-                    "cluster_name": os.environ.get('CLUSTER_NAME', '')
+                    "cluster_name": self.cluster_name
                 }
             }
         }
 
-        instances = self._collect_instances()
-        
-        for instance_id, instance in instances.items():
-            role = instance['tags'].get('Role', '').lower()
-            if role not in ['master', 'worker']:
-                continue
-            
-            group_key = f"k8s_{role}"
-            private_ip = instance['private_ip']
-            
-            inventory[group_key]["hosts"][private_ip] = {}
-            inventory["_meta"]["hostvars"][private_ip] = instance
-            
-            if role == "master":
-                inventory[group_key]["vars"] = {
-                    "is_control_plane": True,
-                    "kube_api_server": f"https://{private_ip}:6443",
-                    "api_server_extra_args": {
-                        "oidc-issuer-url": self.issuer_url,
-                        "oidc-client-id": "sts.amazonaws.com",
-                        "oidc-username-claim": "sub",
-                        "oidc-groups-claim": "groups",
-                        "service-account-key-file": "{{ sa_public_key }}",
-                        "service-account-signing-key-file": "{{ sa_private_key }}",
-                        "api-audiences": f"sts.amazonaws.com,{self.account_id}"
-                    },
-                    # IRSA Configuration (from coreExports.irsaRoleARNs)
-                    "irsa_roles": {
-                        "ebs_csi": os.environ.get("EBS_CSI_ROLE_ARN", ""),
-                        "cluster_autoscaler": os.environ.get("CLUSTER_AUTOSCALER_ROLE_ARN", ""),
-                        "cloudwatch_agent": os.environ.get("CLOUDWATCH_AGENT_ROLE_ARN", "")
-                    }
-                }
-            elif role == "worker":
-                inventory[group_key]["vars"] = {
-                    "is_worker_node": True,
-                    "node_labels": {
-                        "node.kubernetes.io/role": "worker",
-                        "topology.kubernetes.io/region": self.region
-                    }
-                }
+        impaired = {
+            instance_id for instance_id, record in instances.items()
+            if 'impaired' in (record.extra.get('ec2_system_status'), record.extra.get('ec2_instance_status'))
+        }
+        if self.exclude_impaired:
+            for instance_id in impaired:
+                instances.pop(instance_id, None)
+
+        keyed_groups = {}
+        columnar = self._use_columnar(len(instances))
+        if columnar:
+            table = FleetTable(instances.values())
+            role_groups = table.role_groups()
+            if self.keyed_groups:
+                keyed_groups = self.keyed_groups.columnar_groups(table, table.mask('role', K8S_ROLES))
+        else:
+            role_groups = group_records_by_role(instances.values())
+
+        if impaired and not self.exclude_impaired:
+            inventory["impaired"] = {
+                "hosts": {instances[i].private_ip: {} for i in sorted(impaired) if instances[i].role in K8S_ROLES},
+                "vars": {}
+            }
+
+        hosts = [record for records in role_groups.values() for record in records]
+        if len(self.regions) > 1:
+            self._add_region_groups(inventory, hosts)
+        if len({account for account, _ in self.clients}) > 1:
+            for record in hosts:
+                self._add_to_group(inventory, safe_group_name('account', record.account or self.account_id),
+                                   record.private_ip)
+        if self.bastions:
+            self._assign_bastions(hosts)
+        if self.probe_hosts:
+            unreachable = self._probe_hosts(hosts)
+            inventory["unreachable"] = {"hosts": {record.private_ip: {} for record in unreachable}, "vars": {}}
+
+        for role, records in role_groups.items():
+            group = inventory[f"k8s_{role}"]
+            for record in records:
+                group["hosts"][record.private_ip] = {}
+                inventory["_meta"]["hostvars"][record.private_ip] = record.to_hostvars()
+                if self.keyed_groups and not columnar:
+                    for name in self.keyed_groups.groups_for(record):
+                        self._add_to_group(inventory, name, record.private_ip)
+
+        for name, records in keyed_groups.items():
+            for record in records:
+                self._add_to_group(inventory, name, record.private_ip)
+
+        if self.fact_cache_dir:
+            self._seed_fact_cache(hosts)
+
+        if role_groups.get('master'):
+            inventory["k8s_master"]["vars"] = self._master_vars(role_groups['master'][-1].private_ip)
+        if role_groups.get('worker'):
+            inventory["k8s_worker"]["vars"] = self._worker_vars()
+            if self.fetch_join_params and role_groups.get('master'):
+                inventory["k8s_worker"]["vars"].update(self._join_params(role_groups['master'][-1]))
+            if self.worker_max_unavailable:
+                self._add_worker_batches(inventory, role_groups['worker'])
 
         return inventory
 
-    def _collect_instances(self):
+    def _seed_fact_cache(self, records):
+        # jsonfile fact cache: one JSON document per inventory hostname.
+        # EC2 metadata facts are authoritative; facts a previous gather_facts
+        # produced are otherwise kept.
+        os.makedirs(self.fact_cache_dir, exist_ok=True)
+        for record in records:
+            region = record.region or self.region
+            domain = "ec2.internal" if region == "us-east-1" else f"{region}.compute.internal"
+            path = os.path.join(self.fact_cache_dir, record.private_ip)
+            facts = self.cache.read_json(path) or {}
+            hostname = f"ip-{record.private_ip.replace('.', '-')}"
+            facts.update({
+                "ansible_ec2_instance_id": record.instance_id,
+                "ansible_ec2_instance_type": record.instance_type,
+                "ansible_ec2_ami_id": record.image_id,
+                "ansible_ec2_local_ipv4": record.private_ip,
+                "ansible_ec2_public_ipv4": record.public_ip,
+                "ansible_ec2_placement_availability_zone": record.az,
+                "ansible_ec2_placement_region": region
+            })
+            facts.setdefault("ansible_hostname", hostname)
+            facts.setdefault("ansible_fqdn", f"{hostname}.{domain}")
+            facts.setdefault("ansible_default_ipv4", {"address": record.private_ip})
+            facts.setdefault("ansible_all_ipv4_addresses", [record.private_ip])
+            if "node_vcpus" in record.extra:
+                facts.setdefault("ansible_processor_vcpus", record.extra["node_vcpus"])
+                facts.setdefault("ansible_memtotal_mb", record.extra["node_memory_mib"])
+            self.cache.write_json(path, facts)
+
+    def _join_params(self, master):
+        cache_path = os.path.join(self.cache.cache_dir, "join_cache.json")
+        cached = self.cache.read_json(cache_path) or {}
+        if cached.get('master') == master.private_ip and cached.get('expires_at', 0) > time.time():
+            return cached['params']
+
+        common_args = master.extra.get("ansible_ssh_common_args", self.common_args)
+        try:
+            result = subprocess.run(
+                ["ssh", "-q", "-o", "BatchMode=yes", *shlex.split(common_args), "-i", self.ssh_key_path,
+                 f"ubuntu@{master.private_ip}",
+                 f"sudo kubeadm token create --print-join-command --ttl {self.join_token_ttl}s"],
+                check=True,
+                capture_output=True,
+                text=True,
+                timeout=30
+            )
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            print(f"Join parameter fetch failed: {e}", file=sys.stderr)
+            return {}
+
+        params = parse_join_command(result.stdout)
+        if params:
+            params["join_token_expires_at"] = time.time() + self.join_token_ttl
+            self.cache.write_json(cache_path, {
+                "master": master.private_ip,
+                "expires_at": time.time() + self.join_cache_ttl,
+                "params": params
+            })
+        return params
+
+    def _add_worker_batches(self, inventory, workers):
+        max_unavailable = parse_max_unavailable(self.worker_max_unavailable, len(workers))
+        batches = plan_rolling_batches(workers, max_unavailable)
+        for index, batch in enumerate(batches, start=1):
+            inventory[f"worker_batch_{index}"] = {
+                "hosts": {record.private_ip: {} for record in batch},
+                "vars": {"worker_batch_index": index}
+            }
+        inventory["k8s_worker"]["vars"]["worker_batch_count"] = len(batches)
+
+    def _target_of(self, record):
+        return (record.account or self.account_id, record.region or self.region)
+
+    def _add_region_groups(self, inventory, records):
+        for record in records:
+            region = record.region or self.region
+            self._add_to_group(inventory, safe_group_name('region', region), record.private_ip)
+            # Per-host region, overriding the primary-region defaults in
+            # all.vars and the k8s_worker group vars
+            record.extra["aws_region"] = region
+            if record.role == 'worker':
+                record.extra["node_labels"] = {
+                    "node.kubernetes.io/role": "worker",
+                    "topology.kubernetes.io/region": region
+                }
+
+    def _add_to_group(self, inventory, group_name, private_ip):
+        inventory.setdefault(group_name, {"hosts": {}, "vars": {}})["hosts"][private_ip] = {}
+
+    def _use_columnar(self, host_count):
+        if self.columnar_mode in ('0', 'false', 'off') or np is None:
+            return False
+        if self.columnar_mode in ('1', 'true', 'on'):
+            return True
+        # The table only pays for its build cost across several derived
+        # group passes; role grouping alone is faster in the loop
+        return bool(self.keyed_groups) and host_count >= self.columnar_min_hosts
+
+    def _master_vars(self, private_ip):
+        return {
+            "is_control_plane": True,
+            "kube_api_server": f"https://{private_ip}:6443",
+            "api_server_extra_args": {
+                "oidc-issuer-url": self.issuer_url,
+                "oidc-client-id": "sts.amazonaws.com",
+                "oidc-username-claim": "sub",
+                "oidc-groups-claim": "groups",
+                "service-account-key-file": "{{ sa_public_key }}",
+                "service-account-signing-key-file": "{{ sa_private_key }}",
+                "api-audiences": f"sts.amazonaws.com,{self.account_id}"
+            },
+            # IRSA Configuration (from coreExports.irsaRoleARNs)
+            "irsa_roles": {
+                "ebs_csi": os.environ.get("EBS_CSI_ROLE_ARN", ""),
+                "cluster_autoscaler": os.environ.get("CLUSTER_AUTOSCALER_ROLE_ARN", ""),
+                "cloudwatch_agent": os.environ.get("CLOUDWATCH_AGENT_ROLE_ARN", "")
+            }
+        }
+
+    def _worker_vars(self):
+        return {
+            "is_worker_node": True,
+            "node_labels": {
+                "node.kubernetes.io/role": "worker",
+                "topology.kubernetes.io/region": self.region
+            }
+        }
+
+    def _collect_instances(self, roles=K8S_ROLES):
+        if len(self.clients) == 1:
+            instances = self._collect_target(self.primary, roles)
+        else:
+            # Each account/region is swept on its own thread so a slow one
+            # does not hold the others back
+            instances = {}
+            with ThreadPoolExecutor(max_workers=len(self.clients)) as pool:
+                for target_instances in pool.map(
+                    _in_context(lambda target: self._collect_target(target, roles)), list(self.clients)
+                ):
+                    instances.update(target_instances)
+
+        if 'worker' in roles:
+            self._add_asg_instances(instances)
+        return instances
+
+    def _collect_target(self, target, roles=K8S_ROLES):
+        account, region = target
         instances = {}
         
         # Cluster ownership filter (matches securityTags.clusterTag)
@@ -192,79 +1857,551 @@ class Ec2Inventory:
         }]
 
         try:
-            paginator = self.ec2_paginator.paginate(
+            paginator = self.clients[target].ec2_paginator.paginate(
                 Filters=[
                     *cluster_filter,
-                    {'Name': 'tag:Role', 'Values': ['master', 'worker']},
+                    {'Name': 'tag:Role', 'Values': sorted(roles)},
                     {'Name': 'instance-state-name', 'Values': ['running']}
                 ]
             )
             for page in paginator:
                 for reservation in page['Reservations']:
                     for instance in reservation['Instances']:
-                        self._add_instance(instance['InstanceId'], instances)
-        except ClientError as e:
-            print(f"EC2 query error: {e}", file=sys.stderr)
-
-        # Add ASG workers (from workerAsgName export)
-        if self.asg_name:
-            try:
-                asg_instances = self.asg_client.describe_auto_scaling_instances(MaxRecords=100)
-                for instance in asg_instances['AutoScalingInstances']:
-                    if instance['AutoScalingGroupName'] == self.asg_name:
-                        self._add_instance(instance['InstanceId'], instances)
-            except ClientError as e:
-                print(f"ASG error: {e}", file=sys.stderr)
-                
+                        instances[instance['InstanceId']] = self._format_instance(instance, region, account)
+        except (ClientError, BotoCoreError) as e:
+            print(f"EC2 query error in {account}/{region}: {e}", file=sys.stderr)
+            _collection_error(f"EC2 query failed in {account}/{region}")
         return instances
 
-    def _add_instance(self, instance_id, instances):
-        if instance_id in instances:
+    def _add_asg_instances(self, instances):
+        # Add ASG workers (from workerAsgName export) the tag sweep missed
+        if not self.asg_name:
+            return
+        try:
+            groups = self.asg_client.describe_auto_scaling_groups(
+                AutoScalingGroupNames=[self.asg_name]
+            )['AutoScalingGroups']
+        except (ClientError, BotoCoreError) as e:
+            print(f"ASG error: {e}", file=sys.stderr)
+            _collection_error(f"ASG {self.asg_name} lookup failed")
             return
-            
-        instance_data = self._get_instance_details(instance_id)
-        if instance_data:
-            instances[instance_id] = instance_data
+        run = _REFRESH_RUN.get()
+        if run is not None:
+            run.asg_groups = groups
+
+        missing = [
+            instance['InstanceId']
+            for group in groups
+            for instance in group.get('Instances', [])
+            if instance['InstanceId'] not in instances
+        ]
+        for chunk in _chunks(missing, 200):
+            try:
+                for page in self.ec2_paginator.paginate(
+                    InstanceIds=chunk,
+                    Filters=[{'Name': 'instance-state-name', 'Values': ['running']}]
+                ):
+                    for reservation in page['Reservations']:
+                        for instance in reservation['Instances']:
+                            instances[instance['InstanceId']] = self._format_instance(instance, self.region, self.account_id)
+            except (ClientError, BotoCoreError) as e:
+                print(f"ASG instance lookup error: {e}", file=sys.stderr)
+                _collection_error(f"ASG {self.asg_name} instance lookup failed")
+
+    @staticmethod
+    def _format_instance(instance, region='', account=''):
+        return InstanceRecord(
+            instance_id=instance['InstanceId'],
+            private_ip=instance.get('PrivateIpAddress', ''),
+            public_ip=instance.get('PublicIpAddress', ''),
+            az=_intern(instance['Placement']['AvailabilityZone']),
+            launch_time=instance['LaunchTime'].timestamp(),
+            image_id=_intern(instance['ImageId']),
+            instance_type=_intern(instance.get('InstanceType', '')),
+            tags=tuple((_intern(t['Key'].lower()), _intern(t['Value'])) for t in instance.get('Tags', [])),
+            region=_intern(region),
+            account=_intern(account)
+        )
+
+def _sweep_target(clients):
+    records = []
+    for page in clients.ec2_paginator.paginate(
+        Filters=[
+            {'Name': 'tag-key', 'Values': [f"{CLUSTER_TAG_PREFIX}*"]},
+            {'Name': 'tag:Role', 'Values': ['master', 'worker']},
+            {'Name': 'instance-state-name', 'Values': ['running']}
+        ]
+    ):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                records.append(Ec2Inventory._format_instance(instance, clients.region, clients.account))
+    return records
+
+def sweep_clusters(inventories):
+    # One describe_instances sweep per (account, region) any of the
+    # clusters covers, split in memory by cluster ownership tag. Each
+    # cluster only takes hosts from its own targets. The sweep runs against
+    # REFRESH_DEADLINE like a single refresh; any failure returns None.
+    targets = {}
+    for inventory in inventories.values():
+        for target, clients in inventory.clients.items():
+            targets.setdefault(target, clients)
+    budget = min(inventory.refresh_deadline for inventory in inventories.values())
+    run = RefreshRun(budget if budget > 0 else None)
+    result = {}
 
-    def _get_instance_details(self, instance_id):
+    def sweep():
+        _REFRESH_RUN.set(run)
         try:
-            response = self.ec2_client.describe_instances(InstanceIds=[instance_id])
-            instance = response['Reservations'][0]['Instances'][0]
-            return self._format_instance(instance)
-        except (ClientError, KeyError) as e:
-            print(f"Instance {instance_id} error: {e}", file=sys.stderr)
-            return None
+            with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+                result["swept"] = dict(zip(targets, pool.map(_in_context(_sweep_target), targets.values())))
+        except RefreshDeadlineExceeded as e:
+            run.errors.append(str(e))
+        except Exception as e:
+            run.errors.append(f"EC2 query error: {e!r}")
 
-    def _format_instance(self, instance):
-        tags = {t['Key'].lower(): t['Value'] for t in instance.get('Tags', [])}
-        return {
-            "private_ip": instance.get('PrivateIpAddress', ''),
-            "public_ip": instance.get('PublicIpAddress', ''),
-            "tags": tags,
-            "_meta": {
-                "az": instance['Placement']['AvailabilityZone'],
-                "launch_time": instance['LaunchTime'].timestamp(),
-                "image_id": instance['ImageId'],
-                "id": instance['InstanceId'],
-                "type": instance.get('InstanceType', '')
-            }
+    worker = threading.Thread(target=sweep, daemon=True)
+    worker.start()
+    worker.join(run.budget)
+    if worker.is_alive():
+        run.errors.append(f"sweep still running after {run.budget:g}s deadline")
+    if run.errors or "swept" not in result:
+        print(f"Cluster sweep failed, collecting per cluster: {'; '.join(run.errors)}", file=sys.stderr)
+        return None
+    fleets = {name: {} for name in inventories}
+    for target, records in result["swept"].items():
+        for record in records:
+            for name, inventory in inventories.items():
+                if target in inventory.clients and record.tag(f"{CLUSTER_TAG_PREFIX}{name}") in ('shared', 'owned'):
+                    fleets[name][record.instance_id] = record
+    return fleets
+
+def write_private_json(path, data):
+    # Inventories can carry join tokens; created 0600 like the cache files
+    with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+        json.dump(data, f, indent=2)
+    os.chmod(path, 0o600)
+
+def run_cluster_batch(clusters, output_dir):
+    inventories = {
+        cluster['cluster_name']: Ec2Inventory(
+            master_public_ip=cluster['master_ip'],
+            bastion_public_ip=cluster['bastion_ip'],
+            worker_asg_name=cluster['worker_asg'],
+            issuer_url=cluster['issuer_url'],
+            account_id=cluster['account_id'],
+            role_name=cluster['role_name'],
+            domain=cluster['domain'],
+            cluster_name=cluster['cluster_name']
+        )
+        for cluster in clusters
+    }
+    results = {name: inventory.cached_inventory() for name, inventory in inventories.items()}
+    stale = [name for name, result in results.items() if result is None]
+    if stale:
+        fleets = sweep_clusters({name: inventories[name] for name in stale})
+        for name in stale:
+            # A failed sweep falls back to each cluster collecting on its own
+            results[name] = inventories[name].refresh_inventory(
+                fleets[name] if fleets else None, previous=inventories[name].cached_snapshot
+            )
+
+    os.makedirs(output_dir, exist_ok=True)
+    for name, inventory in results.items():
+        write_private_json(os.path.join(output_dir, f"{name}.json"), inventory)
+    return results
+
+# Per-process state for the template pre-render pool, set by _init_renderer
+_RENDER_STATE = {}
+
+def _regex_replace(value, pattern='', replacement='', ignorecase=False):
+    return re.sub(pattern, replacement, str(value), flags=re.I if ignorecase else 0)
+
+def _mandatory(value, msg=None):
+    if isinstance(value, jinja2.Undefined):
+        raise jinja2.UndefinedError(msg or "Mandatory variable not defined")
+    return value
+
+def _combine(*dicts, recursive=False):
+    result = {}
+    for item in dicts:
+        for key, value in item.items():
+            if recursive and isinstance(value, dict) and isinstance(result.get(key), dict):
+                result[key] = _combine(result[key], value, recursive=True)
+            else:
+                result[key] = value
+    return result
+
+ANSIBLE_FILTERS = {
+    "regex_replace": _regex_replace,
+    "mandatory": _mandatory,
+    "combine": _combine,
+    "b64encode": lambda value: base64.b64encode(str(value).encode()).decode(),
+    "to_json": json.dumps,
+    "to_yaml": lambda value: yaml.safe_dump(value, default_flow_style=False),
+    "bool": lambda value: str(value).lower() in ('1', 'true', 'yes', 'on')
+}
+
+def _load_yaml(path):
+    try:
+        with open(path) as f:
+            return yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        return {}
+
+def _is_playbook(source):
+    # Some role template dirs also hold playbooks; those are not rendered
+    for line in source.splitlines():
+        stripped = line.strip()
+        if stripped and not stripped.startswith('#') and stripped != '---':
+            return stripped.startswith('- ')
+    return False
+
+def parse_extra_vars(values):
+    # Same forms as ansible-playbook -e: key=value pairs, JSON, or @file
+    extra_vars = {}
+    for value in values or ():
+        if value.startswith('@'):
+            extra_vars.update(_load_yaml(value[1:]))
+        elif value.lstrip().startswith('{'):
+            extra_vars.update(json.loads(value))
+        else:
+            extra_vars.update(pair.split('=', 1) for pair in shlex.split(value) if '=' in pair)
+    return extra_vars
+
+def _init_renderer(inventory, ansible_dir, fact_cache_dir, extra_vars):
+    env = jinja2.Environment(undefined=jinja2.StrictUndefined, keep_trailing_newline=True)
+    env.filters.update(ANSIBLE_FILTERS)
+    roles = {}
+    roles_dir = os.path.join(ansible_dir, "roles")
+    for role in sorted(os.listdir(roles_dir)):
+        templates_dir = os.path.join(roles_dir, role, "templates")
+        if not os.path.isdir(templates_dir):
+            continue
+        templates = {}
+        for name in sorted(os.listdir(templates_dir)):
+            with open(os.path.join(templates_dir, name)) as f:
+                source = f.read()
+            if _is_playbook(source):
+                continue
+            try:
+                templates[name] = env.from_string(source)
+            except jinja2.TemplateSyntaxError as e:
+                templates[name] = f"TemplateSyntaxError: {e} (line {e.lineno})"
+        roles[role] = {
+            "defaults": _load_yaml(os.path.join(roles_dir, role, "defaults", "main.yml")),
+            "vars": _load_yaml(os.path.join(roles_dir, role, "vars", "main.yml")),
+            "templates": templates
+        }
+
+    hostvars = inventory.get('_meta', {}).get('hostvars', {})
+    groups = {name: list(group['hosts']) for name, group in inventory.items() if 'hosts' in group}
+    groups['all'] = list(hostvars)
+    _RENDER_STATE.update(
+        env=env,
+        roles=roles,
+        hostvars=hostvars,
+        groups=groups,
+        group_vars={name: inventory[name].get('vars', {}) for name in groups if name in inventory},
+        all_vars=inventory.get('all', {}).get('vars', {}),
+        playbook_vars=_load_yaml(os.path.join(ansible_dir, "group_vars", "all.yaml")),
+        fact_cache_dir=fact_cache_dir,
+        extra_vars=extra_vars
+    )
+
+def _render_host(host):
+    state = _RENDER_STATE
+    facts = {}
+    if state['fact_cache_dir']:
+        try:
+            with open(os.path.join(state['fact_cache_dir'], host)) as f:
+                facts = json.load(f)
+        except (OSError, ValueError):
+            pass
+    member_vars = [state['group_vars'][name] for name in sorted(state['group_vars'])
+                   if host in state['groups'][name]]
+
+    results = {}
+    for role_name, role in state['roles'].items():
+        # Ansible precedence, lowest first
+        context = {}
+        for layer in (role['defaults'], state['all_vars'], state['playbook_vars'], *member_vars,
+                      state['hostvars'].get(host, {}), facts, role['vars'], state['extra_vars']):
+            context.update(layer)
+        context.update(inventory_hostname=host, groups=state['groups'], hostvars=state['hostvars'])
+        # Variables may themselves be templates; resolve what can be resolved
+        for _ in range(3):
+            for key, value in context.items():
+                if isinstance(value, str) and '{{' in value:
+                    try:
+                        context[key] = state['env'].from_string(value).render(context)
+                    except jinja2.TemplateError:
+                        pass
+
+        for name, template in role['templates'].items():
+            key = f"{role_name}/{name}"
+            if isinstance(template, str):
+                results[key] = {"error": template}
+                continue
+            try:
+                output = template.render(context)
+            except Exception as e:
+                results[key] = {"error": f"{type(e).__name__}: {e}"}
+                continue
+            results[key] = {"digest": hashlib.sha256(output.encode()).hexdigest(), "output": output}
+    return host, results
+
+class TemplatePrerenderer:
+    # Renders every role template for every inventory host in a process
+    # pool, so template errors surface before any SSH work. Output digests
+    # are kept between runs to report which rendered files changed.
+    def __init__(self, cache, ansible_dir, fact_cache_dir='', extra_vars=None, workers=None):
+        if jinja2 is None:
+            raise SystemExit("Template pre-render requires jinja2 and PyYAML")
+        self.cache = cache
+        self.ansible_dir = ansible_dir
+        self.fact_cache_dir = fact_cache_dir
+        self.extra_vars = extra_vars or {}
+        self.workers = workers
+        self.digest_file = os.path.join(cache.cache_dir, "render_digests.json")
+
+    def run(self, inventory, output_dir=None):
+        hosts = sorted(inventory.get('_meta', {}).get('hostvars', {}))
+        previous = self.cache.read_json(self.digest_file) or {}
+        digests = {}
+        report = {"hosts": len(hosts), "rendered": 0, "unchanged": 0, "changed": [], "failed": []}
+
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_renderer,
+            initargs=(inventory, self.ansible_dir, self.fact_cache_dir, self.extra_vars)
+        ) as pool:
+            for host, results in pool.map(_render_host, hosts, chunksize=max(1, len(hosts) // 64)):
+                digests[host] = {}
+                for template, result in results.items():
+                    if "error" in result:
+                        report["failed"].append({"host": host, "template": template, "error": result["error"]})
+                        continue
+                    report["rendered"] += 1
+                    digests[host][template] = result["digest"]
+                    if previous.get(host, {}).get(template) == result["digest"]:
+                        report["unchanged"] += 1
+                        continue
+                    report["changed"].append({"host": host, "template": template})
+                    if output_dir:
+                        path = os.path.join(output_dir, host, template)
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        with open(path, 'w') as f:
+                            f.write(result["output"])
+
+        self.cache.write_json(self.digest_file, digests)
+        return report
+
+class FleetExecutor:
+    # Runs one command on many hosts through the bastion(s) over asyncio
+    # subprocesses. One multiplexed ControlMaster connection per bastion is
+    # shared by every host's ProxyCommand.
+    def __init__(self, inventory, ssh_key_path, bastion_ip, concurrency=32, timeout=60):
+        self.inventory = inventory
+        self.hostvars = inventory.get('_meta', {}).get('hostvars', {})
+        self.ssh_key_path = ssh_key_path
+        self.bastion_ip = bastion_ip
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.control_paths = {}
+
+    def hosts(self, group=None):
+        if group:
+            return list(self.inventory.get(group, {}).get('hosts', {}))
+        return list(self.hostvars)
+
+    def _bastion_for(self, host):
+        return self.hostvars.get(host, {}).get('bastion_ip', self.bastion_ip)
+
+    async def _open_jump(self, bastion_ip, control_path):
+        proc = await asyncio.create_subprocess_exec(
+            "ssh", "-q", "-M", "-N", "-f", "-o", "BatchMode=yes", "-o", "ControlPersist=yes",
+            "-o", f"ControlPath={control_path}", "-o", "StrictHostKeyChecking=no",
+            "-o", "UserKnownHostsFile=/dev/null", "-i", self.ssh_key_path, f"ubuntu@{bastion_ip}",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        if await proc.wait() != 0:
+            print(f"Jump connection to {bastion_ip} failed", file=sys.stderr)
+
+    async def _close_jump(self, bastion_ip, control_path):
+        proc = await asyncio.create_subprocess_exec(
+            "ssh", "-q", "-o", f"ControlPath={control_path}", "-O", "exit", f"ubuntu@{bastion_ip}",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        await proc.wait()
+
+    async def _run_host(self, host, command, semaphore):
+        bastion_ip = self._bastion_for(host)
+        proxy = f"ssh -o ControlPath={self.control_paths[bastion_ip]} -W %h:%p -i {self.ssh_key_path} ubuntu@{bastion_ip}"
+        result = {"host": host, "rc": None, "stdout": "", "stderr": ""}
+        async with semaphore:
+            start = time.monotonic()
+            proc = await asyncio.create_subprocess_exec(
+                "ssh", "-q", "-o", "BatchMode=yes", "-o", "StrictHostKeyChecking=no",
+                "-o", "UserKnownHostsFile=/dev/null", "-o", f"ProxyCommand={proxy}",
+                "-i", self.ssh_key_path, f"ubuntu@{host}", command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), self.timeout)
+                result.update(rc=proc.returncode, stdout=stdout.decode(errors='replace'),
+                              stderr=stderr.decode(errors='replace'))
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                result["stderr"] = f"timed out after {self.timeout}s"
+            result["elapsed_ms"] = round((time.monotonic() - start) * 1000, 1)
+        return result
+
+    async def run(self, command, group=None, out=sys.stdout):
+        hosts = self.hosts(group)
+        control_dir = tempfile.mkdtemp(prefix="fleet-exec-")
+        self.control_paths = {
+            bastion_ip: os.path.join(control_dir, str(index))
+            for index, bastion_ip in enumerate(sorted({self._bastion_for(h) for h in hosts}))
         }
+        failures = 0
+        try:
+            await asyncio.gather(*(self._open_jump(b, p) for b, p in self.control_paths.items()))
+            semaphore = asyncio.Semaphore(self.concurrency)
+            for task in asyncio.as_completed([self._run_host(h, command, semaphore) for h in hosts]):
+                result = await task
+                failures += result["rc"] != 0
+                print(json.dumps(result), file=out, flush=True)
+        finally:
+            await asyncio.gather(*(self._close_jump(b, p) for b, p in self.control_paths.items()))
+            shutil.rmtree(control_dir, ignore_errors=True)
+        return failures
 
 def main():
-    if len(sys.argv) != 8:
-        print("Usage: ./dynamic_inventory.py <master_ip> <bastion_ip> <worker_asg> <issuer_url> <account_id> <role_name> <domain>")
-        sys.exit(1)
-        
-    inventory = Ec2Inventory(
-        master_public_ip=sys.argv[1],
-        bastion_public_ip=sys.argv[2],
-        worker_asg_name=sys.argv[3],
-        issuer_url=sys.argv[4],
-        account_id=sys.argv[5],
-        role_name=sys.argv[6],
-        domain=sys.argv[7]
-    ).get_inventory()
-    
+    parser = argparse.ArgumentParser(description="Dynamic EC2 inventory for the kubeadm cluster")
+    for name in CLUSTER_FIELDS:
+        parser.add_argument(name, nargs="?")
+    parser.add_argument("--clusters-file", metavar="FILE",
+                        help="JSON list of clusters (cluster_name plus the positional fields) "
+                             "collected with one EC2 sweep; requires --batch-output")
+    parser.add_argument("--batch-output", metavar="DIR", help="write <cluster_name>.json inventories into DIR")
+    parser.add_argument("--shard", type=parse_shard, metavar="i/N",
+                        help="print only shard i of N for parallel ansible-playbook processes")
+    parser.add_argument("--shard-dir", metavar="DIR",
+                        help="write inventory_shard_<i>.json files for --shard-count shards into DIR")
+    parser.add_argument("--shard-count", type=int, default=0, metavar="N")
+    parser.add_argument("--exec", dest="exec_command", metavar="CMD",
+                        help="run CMD on every host (or --group) and stream JSON lines instead of printing the inventory")
+    parser.add_argument("--group", help="limit --exec to one inventory group")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--exec-timeout", type=int, default=60, metavar="SECONDS")
+    parser.add_argument("--render-templates", action="store_true",
+                        help="render all role templates for every host offline and print a JSON report")
+    parser.add_argument("--ansible-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "ansible"))
+    parser.add_argument("--render-output", metavar="DIR", help="write changed rendered templates under DIR/<host>/")
+    parser.add_argument("-e", "--extra-vars", action="append", metavar="VARS",
+                        help="extra variables for --render-templates, as accepted by ansible-playbook -e")
+    parser.add_argument("--as-of", type=parse_time, metavar="TIME",
+                        help="serve the inventory as it was at TIME (epoch seconds or ISO-8601) from the history store")
+    parser.add_argument("--snapshot", type=int, metavar="ID", help="serve history snapshot ID")
+    parser.add_argument("--list-snapshots", action="store_true", help="list history snapshots and exit")
+    parser.add_argument("--launched-since", type=parse_time, metavar="TIME",
+                        help="print hosts of the selected snapshot launched at or after TIME")
+    parser.add_argument("--image", metavar="AMI", help="print hosts of the selected snapshot running AMI")
+    parser.add_argument("--cluster", metavar="NAME",
+                        help="read the history of cluster NAME, as recorded by a --clusters-file batch")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep polling EC2, updating the cache and printing host added/removed/changed "
+                             "events as JSON lines")
+    args = parser.parse_args()
+    if args.shard_dir and args.shard_count < 1:
+        parser.error("--shard-dir requires --shard-count >= 1")
+    if args.watch and (args.as_of is not None or args.snapshot is not None):
+        parser.error("--watch follows the live fleet and cannot be combined with --as-of or --snapshot")
+
+    if args.clusters_file:
+        if not args.batch_output:
+            parser.error("--clusters-file requires --batch-output")
+        with open(args.clusters_file) as f:
+            clusters = json.load(f)
+        for cluster in clusters:
+            missing = [name for name in ('cluster_name', *CLUSTER_FIELDS) if name not in cluster]
+            if missing:
+                parser.error(f"cluster entry {cluster.get('cluster_name', '?')} is missing {', '.join(missing)}")
+        run_cluster_batch(clusters, args.batch_output)
+        return
+
+    historical = None
+    host_query = args.launched_since is not None or args.image
+    if args.list_snapshots or host_query or args.as_of is not None or args.snapshot is not None:
+        # Served from the local history store alone, without touching AWS
+        history = InventoryHistory(history_path(CacheManager(), args.cluster))
+        if args.list_snapshots:
+            print(json.dumps(history.snapshots(), indent=2))
+            return
+        snapshot_id = args.snapshot if args.snapshot is not None else history.snapshot_id(args.as_of)
+        historical = history.inventory(snapshot_id) if snapshot_id is not None else None
+        if historical is None:
+            sys.exit("No inventory snapshot matches the requested time or id")
+        if host_query:
+            print(json.dumps(history.hosts(snapshot_id, args.launched_since, args.image), indent=2))
+            return
+
+    ec2_inventory = None
+    if historical is None or args.exec_command or args.render_templates:
+        if any(getattr(args, name) is None for name in CLUSTER_FIELDS):
+            parser.error(f"the following arguments are required: {' '.join(CLUSTER_FIELDS)}")
+        ec2_inventory = Ec2Inventory(
+            master_public_ip=args.master_ip,
+            bastion_public_ip=args.bastion_ip,
+            worker_asg_name=args.worker_asg,
+            issuer_url=args.issuer_url,
+            account_id=args.account_id,
+            role_name=args.role_name,
+            domain=args.domain
+        )
+    if args.watch:
+        try:
+            ec2_inventory.watch()
+        except KeyboardInterrupt:
+            pass
+        return
+    inventory = historical if historical is not None else ec2_inventory.get_inventory()
+
+    master_shard = int(os.environ.get('INVENTORY_MASTER_SHARD', '1'))
+    if args.shard_dir:
+        os.makedirs(args.shard_dir, exist_ok=True)
+        for index, shard in enumerate(shard_inventory(inventory, args.shard_count, master_shard), start=1):
+            write_private_json(os.path.join(args.shard_dir, f"inventory_shard_{index}.json"), shard)
+    if args.shard:
+        index, count = args.shard
+        inventory = shard_inventory(inventory, count, master_shard)[index - 1]
+
+    if args.render_templates:
+        report = TemplatePrerenderer(
+            ec2_inventory.cache,
+            args.ansible_dir,
+            fact_cache_dir=ec2_inventory.fact_cache_dir,
+            extra_vars=parse_extra_vars(args.extra_vars)
+        ).run(inventory, args.render_output)
+        print(json.dumps(report, indent=2))
+        sys.exit(1 if report["failed"] else 0)
+
+    if args.exec_command:
+        executor = FleetExecutor(
+            inventory,
+            ec2_inventory.ssh_key_path,
+            ec2_inventory.bastion_public_ip,
+            concurrency=args.concurrency,
+            timeout=args.exec_timeout
+        )
+        failures = asyncio.run(executor.run(args.exec_command, args.group))
+        sys.exit(1 if failures else 0)
+
     print(json.dumps(inventory, indent=2))
 
 if __name__ == "__main__":
@@ -0,0 +1,37 @@
+import functools
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dynamic_inventory as di
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return di.CacheManager(cache_ttl=300, ttl_floor=60, ttl_ceiling=3600, control_plane_ttl=21600,
+                           cache_dir=str(tmp_path))
+
+
+@pytest.fixture
+def inventory(tmp_path, monkeypatch):
+    # A single-region inventory with real (unsent) boto3 clients, its cache
+    # under tmp_path and no bastion check; AWS calls go through Stubber
+    for name, value in {
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_REGION": "eu-west-2",
+        "API_RATE_LIMIT": "0",
+        "INVENTORY_HISTORY": "false",
+    }.items():
+        monkeypatch.setenv(name, value)
+    for name in ("AWS_REGIONS", "ASSUME_ROLE_TARGETS", "INVENTORY_ENRICHERS", "CHECK_INSTANCE_STATUS",
+                 "EXCLUDE_IMPAIRED", "INSTANCE_TYPE_CATALOG", "FETCH_JOIN_PARAMS", "PROBE_HOSTS",
+                 "BASTION_DISCOVERY", "KEYED_GROUPS", "INVENTORY_COLUMNAR", "FACT_CACHE_DIR"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(di, "CacheManager", functools.partial(di.CacheManager, cache_dir=str(tmp_path)))
+    monkeypatch.setattr(di.Ec2Inventory, "_verify_bastion_connection", lambda self: None)
+    return di.Ec2Inventory('203.0.113.10', '203.0.113.20', 'workers', 'https://oidc.example.com',
+                           '123456789012', 'k8s-node', 'example.com', cluster_name='demo')
@@ -0,0 +1,28 @@
+import dynamic_inventory as di
+
+
+def make_record(index, az='eu-west-2a', role='worker', launch_time=None, **fields):
+    return di.InstanceRecord(**{
+        "instance_id": f"i-{index:08x}",
+        "private_ip": f"10.0.{index // 256}.{index % 256}",
+        "public_ip": '',
+        "az": az,
+        "launch_time": float(index if launch_time is None else launch_time),
+        "image_id": 'ami-1',
+        "instance_type": 't3.medium',
+        "tags": (('role', role),),
+        **fields
+    })
+
+
+def make_inventory(records):
+    inventory = {
+        "k8s_master": {"hosts": {}, "vars": {"is_control_plane": True}},
+        "k8s_worker": {"hosts": {}, "vars": {}},
+        "_meta": {"hostvars": {}},
+        "all": {"vars": {"cluster_name": "demo"}}
+    }
+    for record in records:
+        inventory[f"k8s_{record.role}"]["hosts"][record.private_ip] = {}
+        inventory["_meta"]["hostvars"][record.private_ip] = record.to_hostvars()
+    return inventory
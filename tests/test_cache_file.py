@@ -0,0 +1,99 @@
+import struct
+import zlib
+
+import pytest
+
+import dynamic_inventory as di
+from helpers import make_inventory, make_record
+
+
+def sample_inventory():
+    return make_inventory(
+        [make_record(0, role='master')] + [make_record(i, az=f"eu-west-2{'abc'[i % 3]}") for i in range(1, 7)]
+    )
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    path = tmp_path / "inventory_cache.bin"
+    path.write_bytes(di.InventoryCacheFile.pack(sample_inventory(), 1234.5, {"master": 1.0, "worker": 2.0}))
+    return path
+
+
+def test_cache_round_trip(cache_path):
+    with di.InventoryCacheFile(cache_path) as cache_file:
+        assert cache_file.validated_at == 1234.5
+        assert cache_file.inventory() == sample_inventory()
+        assert cache_file.section('tiers') == {"master": 1.0, "worker": 2.0}
+
+
+def test_cache_sections_load_lazily(cache_path):
+    with di.InventoryCacheFile(cache_path) as cache_file:
+        assert cache_file.group('k8s_master') == {"hosts": {"10.0.0.0": {}}, "vars": {"is_control_plane": True}}
+        assert cache_file.host('10.0.0.3')['_meta']['id'] == 'i-00000003'
+        assert set(cache_file._sections) == {'groups', 'hostvars'}
+
+
+def test_cache_rejects_bad_magic(cache_path):
+    data = bytearray(cache_path.read_bytes())
+    data[:4] = b'JUNK'
+    cache_path.write_bytes(bytes(data))
+    with pytest.raises(di.CacheFormatError, match="not an inventory cache"):
+        di.InventoryCacheFile(cache_path)
+
+
+def test_cache_rejects_other_schema_version(cache_path):
+    data = bytearray(cache_path.read_bytes())
+    struct.pack_into('<H', data, 4, di.InventoryCacheFile.SCHEMA_VERSION + 1)
+    cache_path.write_bytes(bytes(data))
+    with pytest.raises(di.CacheFormatError, match="schema version"):
+        di.InventoryCacheFile(cache_path)
+
+
+@pytest.mark.parametrize("keep", [0, 10, -20])
+def test_cache_rejects_truncation(cache_path, keep):
+    data = cache_path.read_bytes()
+    cache_path.write_bytes(data[:keep] if keep >= 0 else data[:len(data) + keep])
+    with pytest.raises(di.CacheFormatError):
+        di.InventoryCacheFile(cache_path)
+
+
+def test_cache_rejects_corrupt_section_table(cache_path):
+    data = bytearray(cache_path.read_bytes())
+    data[di.InventoryCacheFile.HEADER.size + 20] ^= 0xff
+    cache_path.write_bytes(bytes(data))
+    with pytest.raises(di.CacheFormatError, match="section table"):
+        di.InventoryCacheFile(cache_path)
+
+
+def test_cache_section_checksum_checked_before_inflating(cache_path):
+    data = bytearray(cache_path.read_bytes())
+    data[-1] ^= 0xff
+    cache_path.write_bytes(bytes(data))
+    with di.InventoryCacheFile(cache_path) as cache_file:
+        # Untouched sections still load
+        assert cache_file.group('k8s_master')["hosts"] == {"10.0.0.0": {}}
+        with pytest.raises(di.CacheFormatError, match="tiers failed its checksum"):
+            cache_file.section('tiers')
+
+
+def test_cache_payloads_are_compressed(cache_path):
+    with di.InventoryCacheFile(cache_path) as cache_file:
+        offset, length, _ = cache_file._table['hostvars']
+        payload = cache_path.read_bytes()[offset:offset + length]
+    assert zlib.decompress(payload).startswith(b'{')
+
+
+def test_cache_manager_round_trip(cache):
+    inventory = sample_inventory()
+    cache.write_cache(inventory, {"master": 1.0, "worker": 2.0})
+    assert cache.read_snapshot() == inventory
+    assert cache.read_tiers() == {"master": 1.0, "worker": 2.0}
+
+
+def test_cache_manager_treats_unreadable_cache_as_missing(cache, capsys):
+    with open(cache.cache_file, 'wb') as f:
+        f.write(b'JUNK' * 16)
+    assert cache.read_snapshot() is None
+    assert cache.read_tiers() == {}
+    assert "Cache read warning" in capsys.readouterr().err
@@ -0,0 +1,38 @@
+import time
+
+import pytest
+
+
+def test_quiet_refreshes_double_the_ttl_up_to_the_ceiling(cache):
+    assert [cache.adapt_ttl() for _ in range(5)] == [600, 1200, 2400, 3600, 3600]
+    assert cache.current_ttl() == 3600
+
+
+@pytest.mark.parametrize("signals,expected", [
+    ({"activities": 1}, 600),
+    ({"churn": 2}, 400),
+    ({"activities": 1, "churn": 2}, 300),
+    ({"churn": 100}, 60),
+])
+def test_activity_and_churn_divide_the_ttl_down_to_the_floor(cache, signals, expected):
+    cache.adapt_ttl()
+    cache.adapt_ttl()
+    assert cache.current_ttl() == 1200
+    assert cache.adapt_ttl(**signals) == expected
+
+
+def test_converging_asg_drops_the_ttl_to_the_floor(cache):
+    cache.adapt_ttl()
+    assert cache.adapt_ttl(capacity_gap=1, activities=1) == 60
+    recorded = cache.read_json(cache.ttl_file)
+    assert (recorded["capacity_gap"], recorded["activities"], recorded["churn"]) == (1, 1, 0)
+
+
+def test_worker_tier_follows_the_adaptive_ttl(cache):
+    assert cache.tier_ttls() == {"master": 21600, "worker": 300}
+    cache.adapt_ttl()
+    assert cache.tier_ttls() == {"master": 21600, "worker": 600}
+    now = time.time()
+    assert cache.stale_tiers({"master": now - 3600, "worker": now - 500}) == set()
+    assert cache.stale_tiers({"master": now - 3600, "worker": now - 700}) == {'worker'}
+    assert cache.stale_tiers({"worker": now}) == {'master'}
@@ -0,0 +1,65 @@
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+import dynamic_inventory as di
+from helpers import make_record
+
+
+@pytest.fixture
+def ec2(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    return boto3.client('ec2', region_name='eu-west-2')
+
+
+def status(instance_id, instance_status):
+    return {
+        "InstanceId": instance_id,
+        "SystemStatus": {"Status": "ok"},
+        "InstanceStatus": {"Status": instance_status}
+    }
+
+
+def test_enricher_requires_fetch():
+    with pytest.raises(TypeError):
+        di.Enricher()
+
+    class Incomplete(di.Enricher):
+        name = 'incomplete'
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_unknown_enrichers_are_skipped(capsys):
+    pipeline = di.EnrichmentPipeline.from_names(['status', 'nope'])
+    assert [enricher.name for enricher in pipeline.enrichers] == ['status']
+    assert "Ignoring unknown enricher: nope" in capsys.readouterr().err
+
+
+def test_status_enricher_annotates_hostvars(ec2):
+    instances = {r.instance_id: r for r in (make_record(1), make_record(2))}
+    with Stubber(ec2) as stubber:
+        stubber.add_response('describe_instance_status', {"InstanceStatuses": [
+            status('i-00000001', 'ok'), status('i-00000002', 'impaired'), status('i-000000ff', 'ok')
+        ]})
+        di.EnrichmentPipeline.from_names(['status']).run(ec2, instances)
+    assert instances['i-00000001'].extra == {"ec2_system_status": "ok", "ec2_instance_status": "ok"}
+    assert instances['i-00000002'].extra["ec2_instance_status"] == "impaired"
+
+
+@pytest.mark.parametrize("required,errors", [((), []), (('status',), ['enricher status failed'])])
+def test_failed_enricher_is_skipped_unless_required(ec2, required, errors, capsys):
+    run = di.RefreshRun()
+    token = di._REFRESH_RUN.set(run)
+    try:
+        instances = {r.instance_id: r for r in (make_record(1),)}
+        with Stubber(ec2) as stubber:
+            stubber.add_client_error('describe_instance_status', service_error_code='UnauthorizedOperation')
+            di.EnrichmentPipeline.from_names(['status']).run(ec2, instances, required)
+    finally:
+        di._REFRESH_RUN.reset(token)
+    assert instances['i-00000001'].extra == {}
+    assert run.errors == errors
+    assert "Enricher status error" in capsys.readouterr().err
@@ -0,0 +1,75 @@
+import pytest
+
+import dynamic_inventory as di
+from helpers import make_inventory, make_record
+
+DAY = 86400
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = di.InventoryHistory(str(tmp_path / "history.sqlite"), retention_days=30)
+    yield history
+    history.close()
+
+
+def test_record_and_read_back(history):
+    inventory = make_inventory([make_record(0, role='master'), make_record(1), make_record(2)])
+    snapshot_id = history.record(inventory, taken_at=100.0)
+    assert history.inventory(snapshot_id) == inventory
+    assert history.snapshots() == [{"id": snapshot_id, "taken_at": 100.0, "hosts": 3}]
+
+
+def test_unchanged_inventory_is_not_recorded_twice(history):
+    inventory = make_inventory([make_record(1)])
+    first = history.record(inventory, taken_at=100.0)
+    assert history.record(inventory, taken_at=200.0) == first
+    assert len(history.snapshots()) == 1
+
+
+def test_probe_measurements_do_not_count_as_changes(history):
+    record = make_record(1)
+    record.extra.update({"reachable": True, "ssh_rtt_ms": 12.5})
+    first = history.record(make_inventory([record]), taken_at=100.0)
+    record.extra.update({"reachable": False, "ssh_rtt_ms": None})
+    assert history.record(make_inventory([record]), taken_at=200.0) == first
+
+
+def test_as_of_picks_the_latest_snapshot_at_or_before(history):
+    first = history.record(make_inventory([make_record(1)]), taken_at=100.0)
+    second = history.record(make_inventory([make_record(1), make_record(2)]), taken_at=200.0)
+    assert history.snapshot_id(as_of=50.0) is None
+    assert history.snapshot_id(as_of=100.0) == first
+    assert history.snapshot_id(as_of=199.0) == first
+    assert history.snapshot_id(as_of=300.0) == second
+    assert history.snapshot_id() == second
+
+
+def test_snapshots_past_retention_are_pruned_with_their_hosts(history):
+    old = history.record(make_inventory([make_record(1)]), taken_at=0.0)
+    history.record(make_inventory([make_record(1), make_record(2)]), taken_at=10 * DAY)
+    latest = history.record(make_inventory([make_record(2)]), taken_at=31 * DAY)
+    assert [snapshot["taken_at"] for snapshot in history.snapshots()] == [10 * DAY, 31 * DAY]
+    assert history.inventory(old) is None
+    assert history.hosts(old) == []
+    assert [host["instance_id"] for host in history.hosts(latest)] == ['i-00000002']
+
+
+def test_host_queries_filter_by_launch_time_and_image(history):
+    records = [make_record(i, launch_time=i * 100, image_id='ami-2' if i % 2 else 'ami-1') for i in range(1, 6)]
+    snapshot_id = history.record(make_inventory(records), taken_at=1000.0)
+    assert [host["instance_id"] for host in history.hosts(snapshot_id, launched_since=300)] == [
+        'i-00000003', 'i-00000004', 'i-00000005'
+    ]
+    assert [host["instance_id"] for host in history.hosts(snapshot_id, launched_since=300, image_id='ami-2')] == [
+        'i-00000003', 'i-00000005'
+    ]
+    assert history.hosts(snapshot_id, image_id='ami-1')[0] == {
+        "instance_id": 'i-00000002', "private_ip": '10.0.0.2', "role": 'worker', "az": 'eu-west-2a',
+        "image_id": 'ami-1', "instance_type": 't3.medium', "launch_time": 200.0
+    }
+
+
+def test_history_path_is_per_cluster(cache):
+    assert di.history_path(cache).endswith("inventory_history.sqlite")
+    assert di.history_path(cache, 'prod').endswith("inventory_history_prod.sqlite")
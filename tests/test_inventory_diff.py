@@ -0,0 +1,59 @@
+import dynamic_inventory as di
+from helpers import make_inventory, make_record
+
+
+def test_diff_records_reports_added_removed_and_changed():
+    previous = {r.instance_id: r for r in (make_record(1), make_record(2), make_record(3))}
+    current = {r.instance_id: r for r in (
+        make_record(1),
+        make_record(2, instance_type='m5.large', tags=(('role', 'worker'), ('team', 'a'))),
+        make_record(4)
+    )}
+    diff = di.diff_records(previous, current)
+    assert [host["id"] for host in diff["added"]] == ['i-00000004']
+    assert [host["id"] for host in diff["removed"]] == ['i-00000003']
+    assert len(diff["changed"]) == 1
+    changed = diff["changed"][0]
+    assert changed["id"] == 'i-00000002'
+    assert changed["fields"]["instance_type"] == ['t3.medium', 'm5.large']
+    assert changed["fields"]["tags"] == [{'role': 'worker'}, {'role': 'worker', 'team': 'a'}]
+
+
+def test_diff_records_of_identical_fleets_is_empty():
+    fleet = {r.instance_id: r for r in (make_record(1), make_record(2))}
+    assert di.diff_records(fleet, dict(fleet)) == {"added": [], "removed": [], "changed": []}
+
+
+def test_baseline_run_has_no_new_nodes(inventory):
+    fresh = make_inventory([make_record(0, role='master'), make_record(1)])
+    diff = inventory._apply_diff(fresh, None)
+    assert diff["baseline"]
+    assert fresh["new_nodes"]["hosts"] == {}
+    assert inventory.cache.read_json(inventory.cache.diff_file)["baseline"]
+
+
+def test_new_and_removed_nodes_follow_the_diff(inventory):
+    previous = make_inventory([make_record(0, role='master'), make_record(1), make_record(2)])
+    fresh = make_inventory([make_record(0, role='master'), make_record(1), make_record(3)])
+    inventory._apply_diff(fresh, previous)
+    assert fresh["new_nodes"]["hosts"] == {"10.0.0.3": {}}
+    assert [host["id"] for host in fresh["removed_nodes"]["vars"]["removed_hosts"]] == ['i-00000002']
+    assert "10.0.0.2" not in fresh["removed_nodes"]["hosts"]
+
+
+def test_watch_polls_accumulate_new_nodes_until_a_regular_refresh(inventory):
+    first = make_inventory([make_record(0, role='master'), make_record(1)])
+    second = make_inventory([make_record(0, role='master'), make_record(1), make_record(2)])
+    inventory._apply_diff(second, first)
+    third = make_inventory([make_record(0, role='master'), make_record(2), make_record(3)])
+    inventory._apply_diff(third, second, keep_new_nodes=True)
+    assert third["new_nodes"]["hosts"] == {"10.0.0.2": {}, "10.0.0.3": {}}
+
+    # Carried additions that have since gone are dropped
+    fourth = make_inventory([make_record(0, role='master'), make_record(3)])
+    inventory._apply_diff(fourth, third, keep_new_nodes=True)
+    assert fourth["new_nodes"]["hosts"] == {"10.0.0.3": {}}
+
+    regular = make_inventory([make_record(0, role='master'), make_record(3)])
+    inventory._apply_diff(regular, fourth)
+    assert regular["new_nodes"]["hosts"] == {}
@@ -0,0 +1,80 @@
+import os
+import stat
+
+import pytest
+
+import dynamic_inventory as di
+from helpers import make_inventory, make_record
+
+
+def inventory_with_join_params(expires_at):
+    inventory = make_inventory([make_record(0, role='master'), make_record(1)])
+    inventory["k8s_worker"]["vars"].update({
+        "kubeadm_join_command": "kubeadm join 10.0.0.0:6443 --token abcdef.0123456789abcdef",
+        "kubeadm_join_endpoint": "10.0.0.0:6443",
+        "join_token": "abcdef.0123456789abcdef",
+        "master_ca_hash": "deadbeef",
+        "join_token_expires_at": expires_at,
+        "is_worker_node": True
+    })
+    return inventory
+
+
+def test_parse_join_command():
+    params = di.parse_join_command(
+        "kubeadm join 10.0.0.10:6443 --token abcdef.0123456789abcdef "
+        "--discovery-token-ca-cert-hash sha256:deadbeef\n"
+    )
+    assert params == {
+        "kubeadm_join_command": "kubeadm join 10.0.0.10:6443 --token abcdef.0123456789abcdef "
+                                "--discovery-token-ca-cert-hash sha256:deadbeef",
+        "kubeadm_join_endpoint": "10.0.0.10:6443",
+        "join_token": "abcdef.0123456789abcdef",
+        "master_ca_hash": "deadbeef"
+    }
+
+
+@pytest.mark.parametrize("output", [
+    "",
+    "error: unable to create token",
+    "kubeadm join 10.0.0.10:6443 --discovery-token-ca-cert-hash sha256:deadbeef",
+    "kubeadm join 10.0.0.10:6443 --token abcdef.0123456789abcdef",
+])
+def test_parse_join_command_rejects_incomplete_output(output):
+    assert di.parse_join_command(output) == {}
+
+
+def test_join_token_expired():
+    assert di.join_token_expired(inventory_with_join_params(100.0), now=100.0)
+    assert not di.join_token_expired(inventory_with_join_params(100.0), now=99.0)
+    assert not di.join_token_expired(make_inventory([make_record(1)]))
+    assert not di.join_token_expired(None)
+
+
+def test_strip_join_params_keeps_other_worker_vars():
+    inventory = inventory_with_join_params(100.0)
+    stripped = di.strip_join_params(inventory)
+    assert stripped["k8s_worker"]["vars"] == {"is_worker_node": True}
+    assert stripped["_meta"] == inventory["_meta"]
+    # The original is left alone
+    assert "join_token" in inventory["k8s_worker"]["vars"]
+
+
+def test_last_known_good_drops_expired_join_params(inventory, capsys):
+    served = inventory._last_known_good(inventory_with_join_params(1.0))
+    assert "join_token" not in served["k8s_worker"]["vars"]
+    assert "Dropping expired join parameters" in capsys.readouterr().err
+
+
+def test_last_known_good_keeps_live_join_params(inventory):
+    previous = inventory_with_join_params(4102444800.0)
+    assert inventory._last_known_good(previous) is previous
+
+
+def test_private_json_is_written_0600(tmp_path):
+    path = tmp_path / "prod.json"
+    path.write_text("{}")
+    os.chmod(path, 0o644)
+    di.write_private_json(str(path), inventory_with_join_params(1.0))
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert '"join_token"' in path.read_text()
@@ -0,0 +1,94 @@
+import pytest
+
+import dynamic_inventory as di
+from helpers import make_record
+
+needs_numpy = pytest.mark.skipif(di.np is None, reason="NumPy not installed")
+
+
+def mixed_fleet():
+    records = [make_record(0, role='master', instance_type='m5.large')]
+    for i in range(1, 13):
+        records.append(make_record(
+            i,
+            az=f"eu-west-2{'abc'[i % 3]}",
+            role='Worker' if i % 5 == 0 else 'worker',
+            image_id=f"ami-{i % 2}",
+            instance_type=('t3.medium', 'm5.xlarge')[i % 2],
+            tags=(('role', 'Worker' if i % 5 == 0 else 'worker'),) + ((('team', 'Data-Eng'),) if i % 4 else ())
+        ))
+    records.append(make_record(20, tags=(('role', 'bastion'),)))
+    return records
+
+
+def loop_groups(rules, records):
+    groups = {}
+    for record in records:
+        if record.role in di.K8S_ROLES:
+            for name in rules.groups_for(record):
+                groups.setdefault(name, []).append(record.instance_id)
+    return groups
+
+
+def test_rules_parse_known_sources_and_skip_unknown(capsys):
+    rules = di.KeyedGroupRules("az, type,ami,tag:Team,,color,tag:")
+    assert [rule[0] for rule in rules.rules] == ['az', 'type', 'ami', 'tag_team']
+    assert "Ignoring unknown keyed group rule: color" in capsys.readouterr().err
+    assert not di.KeyedGroupRules("")
+
+
+def test_groups_for_names_groups_safely():
+    rules = di.KeyedGroupRules("az,type,tag:team")
+    record = make_record(1, instance_type='m5.xlarge', tags=(('role', 'worker'), ('team', 'Data-Eng')))
+    assert list(rules.groups_for(record)) == ['az_eu_west_2a', 'type_m5_xlarge', 'tag_team_data_eng']
+    # Missing values make no group
+    assert list(rules.groups_for(make_record(2))) == ['az_eu_west_2a', 'type_t3_medium']
+
+
+@needs_numpy
+def test_columnar_groups_match_the_loop():
+    rules = di.KeyedGroupRules("az,type,ami,tag:team")
+    records = mixed_fleet()
+    table = di.FleetTable(records)
+    columnar = {
+        name: sorted(record.instance_id for record in members)
+        for name, members in rules.columnar_groups(table, table.mask('role', di.K8S_ROLES)).items()
+    }
+    assert columnar == {name: sorted(ids) for name, ids in loop_groups(rules, records).items()}
+
+
+@needs_numpy
+def test_fleet_table_role_groups_fold_case_and_skip_other_roles():
+    table = di.FleetTable(mixed_fleet())
+    groups = {role: sorted(r.instance_id for r in records) for role, records in table.role_groups().items()}
+    assert groups == {
+        role: sorted(r.instance_id for r in records)
+        for role, records in di.group_records_by_role(mixed_fleet()).items()
+    }
+    assert len(groups['worker']) == 12
+
+
+@needs_numpy
+def test_generated_inventory_is_the_same_with_and_without_the_table(inventory):
+    inventory.keyed_groups = di.KeyedGroupRules("az,type,ami,tag:team")
+    inventories = {}
+    for mode in ('off', 'on'):
+        inventory.columnar_mode = mode
+        inventories[mode] = inventory._generate_fresh_inventory({r.instance_id: r for r in mixed_fleet()})
+    assert inventories['on'] == inventories['off']
+    assert set(inventories['on']['tag_team_data_eng']['hosts']) == {
+        record.private_ip for record in mixed_fleet()[1:13] if record.tag('team')
+    }
+
+
+@pytest.mark.parametrize("mode,keyed,hosts,expected", [
+    ('auto', "", 5000, False),
+    ('auto', "az", 5000, True),
+    ('auto', "az", 10, False),
+    ('on', "", 10, True),
+    ('off', "az", 5000, False),
+])
+def test_auto_mode_only_goes_columnar_for_keyed_groups_on_large_fleets(inventory, mode, keyed, hosts, expected):
+    inventory.columnar_mode = mode
+    inventory.keyed_groups = di.KeyedGroupRules(keyed)
+    assert inventory._use_columnar(hosts) == (expected and di.np is not None)
@@ -0,0 +1,52 @@
+import pytest
+
+import dynamic_inventory as di
+
+
+@pytest.mark.parametrize("spec,network,expected", [
+    ((1, 512, 2, 4), 'flannel', {
+        "kubelet_max_pods": 16,
+        "kubelet_kube_reserved_cpu": "60m",
+        "kubelet_kube_reserved_memory": "431Mi",
+        "kubelet_system_reserved_cpu": "100m",
+        "kubelet_system_reserved_memory": "105Mi",
+        "kubelet_eviction_memory_available": "100Mi"
+    }),
+    ((2, 4096, 3, 6), 'flannel', {
+        "kubelet_max_pods": 32,
+        "kubelet_kube_reserved_cpu": "70m",
+        "kubelet_kube_reserved_memory": "607Mi",
+        "kubelet_system_reserved_cpu": "100m",
+        "kubelet_system_reserved_memory": "140Mi",
+        "kubelet_eviction_memory_available": "204Mi"
+    }),
+    ((2, 8192, 3, 10), 'vpc-cni', {
+        "kubelet_max_pods": 29,
+        "kubelet_kube_reserved_cpu": "70m",
+        "kubelet_kube_reserved_memory": "574Mi",
+        "kubelet_system_reserved_cpu": "100m",
+        "kubelet_system_reserved_memory": "181Mi",
+        "kubelet_eviction_memory_available": "409Mi"
+    }),
+    ((96, 393216, 15, 50), 'flannel', {
+        "kubelet_max_pods": 250,
+        "kubelet_kube_reserved_cpu": "310m",
+        "kubelet_kube_reserved_memory": "3005Mi",
+        "kubelet_system_reserved_cpu": "500m",
+        "kubelet_system_reserved_memory": "1024Mi",
+        "kubelet_eviction_memory_available": "1024Mi"
+    }),
+])
+def test_recommend_kubelet_sizing(spec, network, expected):
+    assert di.recommend_kubelet_sizing(*spec, pod_network=network) == expected
+
+
+def test_vpc_cni_without_eni_limits_falls_back_to_memory():
+    assert di.recommend_kubelet_sizing(4, 16384, 0, 0, pod_network='vpc-cni')["kubelet_max_pods"] == 110
+
+
+def test_system_reservation_grows_with_the_instance():
+    small = di.recommend_kubelet_sizing(2, 4096, 3, 6)
+    medium = di.recommend_kubelet_sizing(8, 32768, 4, 15)
+    assert (small["kubelet_system_reserved_cpu"], small["kubelet_system_reserved_memory"]) == ("100m", "140Mi")
+    assert (medium["kubelet_system_reserved_cpu"], medium["kubelet_system_reserved_memory"]) == ("250m", "427Mi")
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+import dynamic_inventory as di
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(di.time, "time", clock.time)
+    monkeypatch.setattr(di.time, "sleep", clock.sleep)
+    monkeypatch.setattr(di.random, "uniform", lambda low, high: low)
+    return clock
+
+
+def bucket(limiter, key):
+    with open(limiter.path) as f:
+        return json.load(f)[key]
+
+
+def test_burst_is_served_then_acquire_waits_for_a_token(tmp_path, clock):
+    limiter = di.RateLimiter(str(tmp_path / "rates.json"), default_rate=2.0, burst=2.0)
+    limiter.acquire("123/eu-west-2/DescribeInstances", "DescribeInstances")
+    limiter.acquire("123/eu-west-2/DescribeInstances", "DescribeInstances")
+    assert clock.sleeps == []
+    limiter.acquire("123/eu-west-2/DescribeInstances", "DescribeInstances")
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_buckets_are_per_key_and_shared_through_the_state_file(tmp_path, clock):
+    path = str(tmp_path / "rates.json")
+    first = di.RateLimiter(path, default_rate=1.0, burst=1.0)
+    second = di.RateLimiter(path, default_rate=1.0, burst=1.0)
+    first.acquire("123/eu-west-2/DescribeInstances", "DescribeInstances")
+    second.acquire("123/eu-west-1/DescribeInstances", "DescribeInstances")
+    assert clock.sleeps == []
+    second.acquire("123/eu-west-2/DescribeInstances", "DescribeInstances")
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+
+def test_throttling_halves_the_rate_down_to_the_minimum(tmp_path, clock):
+    limiter = di.RateLimiter(str(tmp_path / "rates.json"), default_rate=4.0, min_rate=0.5)
+    key = "123/eu-west-2/DescribeInstances"
+    rates = []
+    for _ in range(5):
+        limiter.record(key, "DescribeInstances", throttled=True)
+        rates.append(bucket(limiter, key)["rate"])
+    assert rates == [2.0, 1.0, 0.5, 0.5, 0.5]
+
+
+def test_successes_creep_back_to_the_per_action_ceiling(tmp_path, clock):
+    limiter = di.RateLimiter(str(tmp_path / "rates.json"), default_rate=10.0,
+                             rates=di.parse_rate_limits("DescribeInstanceStatus=2"))
+    key = "123/eu-west-2/DescribeInstanceStatus"
+    limiter.record(key, "DescribeInstanceStatus", throttled=True)
+    assert bucket(limiter, key)["rate"] == 1.0
+    limiter.record(key, "DescribeInstanceStatus", throttled=False)
+    assert bucket(limiter, key)["rate"] == pytest.approx(1.1)
+    for _ in range(20):
+        limiter.record(key, "DescribeInstanceStatus", throttled=False)
+    assert bucket(limiter, key)["rate"] == 2.0
+
+
+def test_parse_rate_limits():
+    assert di.parse_rate_limits("DescribeInstances=5, DescribeInstanceStatus=2.5,") == {
+        "DescribeInstances": 5.0,
+        "DescribeInstanceStatus": 2.5
+    }
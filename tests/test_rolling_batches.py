@@ -0,0 +1,36 @@
+import pytest
+
+import dynamic_inventory as di
+from helpers import make_record
+
+
+@pytest.mark.parametrize("value,total,expected", [("1", 10, 1), ("3", 10, 3), ("25%", 10, 2), ("1%", 10, 1)])
+def test_parse_max_unavailable(value, total, expected):
+    assert di.parse_max_unavailable(value, total) == expected
+
+
+def test_rolling_batches_never_drain_a_multi_node_zone():
+    workers = [make_record(i, az='eu-west-2a') for i in range(3)] + [make_record(i, az='eu-west-2b') for i in range(3, 5)]
+    batches = di.plan_rolling_batches(workers, max_unavailable=5)
+    zone_sizes = {'eu-west-2a': 3, 'eu-west-2b': 2}
+    for batch in batches:
+        assert len(batch) <= 5
+        for az, size in zone_sizes.items():
+            assert sum(1 for record in batch if record.az == az) < size
+    planned = [record.instance_id for batch in batches for record in batch]
+    assert sorted(planned) == sorted(record.instance_id for record in workers)
+
+
+def test_rolling_batches_spread_zones_and_respect_max_unavailable():
+    workers = [make_record(i, az=f"eu-west-2{'abc'[i % 3]}") for i in range(9)]
+    batches = di.plan_rolling_batches(workers, max_unavailable=3)
+    assert [len(batch) for batch in batches] == [3, 3, 3]
+    for batch in batches:
+        assert len({record.az for record in batch}) == 3
+    # Oldest nodes go first
+    assert [record.instance_id for record in batches[0]] == ['i-00000000', 'i-00000001', 'i-00000002']
+
+
+def test_rolling_batches_single_node_zone_can_be_taken():
+    batches = di.plan_rolling_batches([make_record(0, az='eu-west-2a')], max_unavailable=1)
+    assert [[record.instance_id for record in batch] for batch in batches] == [['i-00000000']]
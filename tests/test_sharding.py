@@ -0,0 +1,40 @@
+import argparse
+
+import pytest
+
+import dynamic_inventory as di
+from helpers import make_inventory, make_record
+
+
+def test_shard_inventory_pins_masters_and_balances_workers():
+    records = [make_record(0, role='master')] + [
+        make_record(i, az=f"eu-west-2{'abc'[i % 3]}") for i in range(1, 13)
+    ]
+    inventory = make_inventory(records)
+    shards = di.shard_inventory(inventory, 3, master_shard=2)
+
+    assert shards[1]["k8s_master"]["hosts"] == {"10.0.0.0": {}}
+    assert all(not shard["k8s_master"]["hosts"] for index, shard in enumerate(shards) if index != 1)
+    sizes = [len(shard["_meta"]["hostvars"]) for shard in shards]
+    assert max(sizes) - min(sizes) <= 1
+    assert sorted(h for shard in shards for h in shard["_meta"]["hostvars"]) == sorted(inventory["_meta"]["hostvars"])
+    for shard in shards:
+        zones = [shard["_meta"]["hostvars"][h]["_meta"]["az"] for h in shard["k8s_worker"]["hosts"]]
+        assert max(zones.count(az) for az in set(zones)) - min(zones.count(az) for az in set(zones)) <= 1
+        assert shard["all"] == inventory["all"]
+
+
+def test_shard_inventory_clamps_master_shard():
+    inventory = make_inventory([make_record(0, role='master'), make_record(1)])
+    shards = di.shard_inventory(inventory, 2, master_shard=5)
+    assert shards[1]["k8s_master"]["hosts"] == {"10.0.0.0": {}}
+
+
+def test_parse_shard():
+    assert di.parse_shard("2/3") == (2, 3)
+
+
+@pytest.mark.parametrize("value", ["0/3", "4/3", "1", "a/b"])
+def test_parse_shard_rejects_bad_values(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        di.parse_shard(value)
@@ -0,0 +1,79 @@
+import time
+from datetime import datetime, timezone
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+import dynamic_inventory as di
+
+ROLE_A = "arn:aws:iam::111111111111:role/inventory"
+ROLE_B = "arn:aws:iam::222222222222:role/inventory"
+
+
+@pytest.fixture
+def sts(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    client = boto3.client('sts', region_name='eu-west-2')
+    monkeypatch.setattr(di.boto3, "client", lambda service, **kwargs: client)
+    with Stubber(client) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+def cached_credentials(expires_at):
+    return {
+        "access_key_id": "AKIAOLD",
+        "secret_access_key": "old",
+        "session_token": "old",
+        "expires_at": expires_at
+    }
+
+
+def assume_role_response(expires_at):
+    return {"Credentials": {
+        "AccessKeyId": "AKIANEWKEY0000000000",
+        "SecretAccessKey": "new",
+        "SessionToken": "new",
+        "Expiration": datetime.fromtimestamp(expires_at, timezone.utc)
+    }}
+
+
+def test_live_credentials_are_served_from_the_cache(cache, sts):
+    sts_cache = di.StsCredentialCache(cache)
+    expires_at = time.time() + 3600
+    cache.write_json(sts_cache.path, {ROLE_A: cached_credentials(expires_at)})
+    credentials = sts_cache.credentials([("111111111111", ROLE_A)])
+    assert credentials == {"111111111111": cached_credentials(expires_at)}
+
+
+def test_credentials_inside_the_refresh_margin_are_renewed(cache, sts):
+    sts_cache = di.StsCredentialCache(cache, refresh_margin=300)
+    cache.write_json(sts_cache.path, {ROLE_A: cached_credentials(time.time() + 200)})
+    expires_at = int(time.time()) + 3600
+    sts.add_response('assume_role', assume_role_response(expires_at),
+                     {"RoleArn": ROLE_A, "RoleSessionName": "dynamic-inventory-111111111111"})
+
+    credentials = sts_cache.credentials([("111111111111", ROLE_A)])
+    assert credentials["111111111111"]["access_key_id"] == "AKIANEWKEY0000000000"
+    assert credentials["111111111111"]["expires_at"] == expires_at
+    assert cache.read_json(sts_cache.path)[ROLE_A]["expires_at"] == expires_at
+
+
+def test_failed_assume_role_leaves_the_account_out(cache, sts, capsys):
+    sts_cache = di.StsCredentialCache(cache)
+    live = cached_credentials(time.time() + 3600)
+    cache.write_json(sts_cache.path, {ROLE_A: live})
+    sts.add_client_error('assume_role', service_error_code='AccessDenied', http_status_code=403)
+
+    credentials = sts_cache.credentials([("111111111111", ROLE_A), ("222222222222", ROLE_B)])
+    assert credentials == {"111111111111": live}
+    assert f"AssumeRole {ROLE_B} failed" in capsys.readouterr().err
+    assert set(cache.read_json(sts_cache.path)) == {ROLE_A}
+
+
+def test_parse_assume_role_targets(capsys):
+    targets = di.parse_assume_role_targets(f"111111111111={ROLE_A}, 333333333333,222222222222={ROLE_B}")
+    assert targets == [("111111111111", ROLE_A), ("222222222222", ROLE_B)]
+    assert "without role ARN: 333333333333" in capsys.readouterr().err
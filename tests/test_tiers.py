@@ -0,0 +1,155 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+from botocore.stub import Stubber
+
+import dynamic_inventory as di
+from helpers import make_inventory, make_record
+
+
+def asg_response(instance_ids):
+    return {"AutoScalingGroups": [{
+        "AutoScalingGroupName": "workers",
+        "MinSize": 0,
+        "MaxSize": 10,
+        "DesiredCapacity": len(instance_ids),
+        "DefaultCooldown": 300,
+        "AvailabilityZones": ["eu-west-2a"],
+        "HealthCheckType": "EC2",
+        "CreatedTime": datetime(2026, 1, 1, tzinfo=timezone.utc),
+        "Instances": [
+            {"InstanceId": instance_id, "AvailabilityZone": "eu-west-2a", "LifecycleState": "InService",
+             "HealthStatus": "Healthy", "ProtectedFromScaleIn": False}
+            for instance_id in instance_ids
+        ]
+    }]}
+
+
+def ec2_instance(record):
+    return {
+        "InstanceId": record.instance_id,
+        "PrivateIpAddress": record.private_ip,
+        "Placement": {"AvailabilityZone": record.az},
+        "LaunchTime": datetime.fromtimestamp(record.launch_time, timezone.utc),
+        "ImageId": record.image_id,
+        "InstanceType": record.instance_type,
+        "Tags": [{"Key": "Role", "Value": record.role}, {"Key": "kubernetes.io/cluster/demo", "Value": "owned"}]
+    }
+
+
+def test_everything_is_stale_without_a_snapshot(inventory):
+    assert inventory._stale_tiers(None, {}) == {'master', 'worker'}
+
+
+def test_expired_worker_tier_is_stale_without_asking_the_asg(inventory):
+    now = time.time()
+    tiers = {"master": now, "worker": now - 7200, "asg_members": ['i-00000001']}
+    with Stubber(inventory.asg_client):
+        assert inventory._stale_tiers(make_inventory([make_record(1)]), tiers) == {'worker'}
+
+
+@pytest.mark.parametrize("in_service,stale", [
+    (['i-00000001', 'i-00000002'], set()),
+    (['i-00000001', 'i-00000002', 'i-00000003'], {'worker'}),
+    (['i-00000001'], {'worker'}),
+    (['i-00000001', 'i-00000003'], {'worker'}),
+])
+def test_asg_membership_change_invalidates_the_worker_tier(inventory, in_service, stale):
+    now = time.time()
+    tiers = {"master": now, "worker": now, "asg_members": ['i-00000001', 'i-00000002']}
+    cached = make_inventory([make_record(0, role='master'), make_record(1), make_record(2)])
+    with Stubber(inventory.asg_client) as asg:
+        asg.add_response('describe_auto_scaling_groups', asg_response(in_service),
+                         {"AutoScalingGroupNames": ['workers']})
+        assert inventory._stale_tiers(cached, tiers) == stale
+
+
+def test_unrecorded_asg_members_invalidate_the_worker_tier(inventory):
+    now = time.time()
+    with Stubber(inventory.asg_client) as asg:
+        asg.add_response('describe_auto_scaling_groups', asg_response(['i-00000001']))
+        assert inventory._stale_tiers(make_inventory([make_record(1)]), {"master": now, "worker": now}) == {'worker'}
+
+
+def test_worker_refresh_keeps_masters_from_the_snapshot(inventory):
+    master = make_record(0, role='master')
+    master_collected_at = time.time() - 60
+    inventory.cache.write_cache(
+        make_inventory([master, make_record(1), make_record(2)]),
+        {"master": master_collected_at, "worker": 0.0, "asg_members": ['i-00000001', 'i-00000002']}
+    )
+    workers = [make_record(1), make_record(3)]
+
+    with Stubber(inventory.ec2_client) as ec2, Stubber(inventory.asg_client) as asg:
+        ec2.add_response('describe_instances', {"Reservations": [{"Instances": [ec2_instance(r) for r in workers]}]}, {
+            "Filters": [
+                {"Name": "tag:kubernetes.io/cluster/demo", "Values": ['shared', 'owned']},
+                {"Name": "tag:Role", "Values": ['worker']},
+                {"Name": "instance-state-name", "Values": ['running']}
+            ]
+        })
+        asg.add_response('describe_auto_scaling_groups', asg_response(['i-00000001', 'i-00000003']))
+        asg.add_response('describe_scaling_activities', {"Activities": []})
+        result = inventory.refresh_inventory(roles={'worker'})
+        ec2.assert_no_pending_responses()
+        asg.assert_no_pending_responses()
+
+    assert inventory.collection_errors == []
+    assert set(result["k8s_master"]["hosts"]) == {master.private_ip}
+    assert set(result["k8s_worker"]["hosts"]) == {'10.0.0.1', '10.0.0.3'}
+    assert result["new_nodes"]["hosts"] == {'10.0.0.3': {}}
+    tiers = inventory.cache.read_tiers()
+    assert tiers["master"] == master_collected_at
+    assert tiers["worker"] > master_collected_at
+    assert tiers["asg_members"] == ['i-00000001', 'i-00000003']
+
+
+def test_fresh_tiers_serve_the_snapshot(inventory):
+    now = time.time()
+    cached = make_inventory([make_record(0, role='master'), make_record(1)])
+    inventory.cache.write_cache(cached, {"master": now, "worker": now, "asg_members": ['i-00000001']})
+    with Stubber(inventory.asg_client) as asg:
+        asg.add_response('describe_auto_scaling_groups', asg_response(['i-00000001']))
+        assert inventory.get_inventory() == cached
+    assert inventory.stale_tiers == set()
+
+
+def test_stale_refresh_reads_the_cache_once(inventory, monkeypatch):
+    opened = []
+
+    class CountingCacheFile(di.InventoryCacheFile):
+        def __init__(self, path):
+            opened.append(path)
+            super().__init__(path)
+
+    monkeypatch.setattr(di, "InventoryCacheFile", CountingCacheFile)
+    inventory.cache.write_cache(
+        make_inventory([make_record(0, role='master'), make_record(1)]),
+        {"master": time.time(), "worker": 0.0, "asg_members": ['i-00000001']}
+    )
+    with Stubber(inventory.ec2_client) as ec2, Stubber(inventory.asg_client) as asg:
+        ec2.add_response('describe_instances', {"Reservations": [{"Instances": [ec2_instance(make_record(1))]}]})
+        asg.add_response('describe_auto_scaling_groups', asg_response(['i-00000001']))
+        asg.add_response('describe_scaling_activities', {"Activities": []})
+        result = inventory.get_inventory()
+    assert set(result["k8s_master"]["hosts"]) == {'10.0.0.0'}
+    assert len(opened) == 1
+
+
+def test_corrupt_hostvars_refresh_every_tier(inventory, capsys):
+    now = time.time()
+    inventory.cache.write_cache(make_inventory([make_record(1)]), {"master": now, "worker": now})
+    with open(inventory.cache.cache_file, 'rb') as f:
+        data = bytearray(f.read())
+    with di.InventoryCacheFile(inventory.cache.cache_file) as cache_file:
+        offset, _, _ = cache_file._table['hostvars']
+    data[offset] ^= 0xff
+    with open(inventory.cache.cache_file, 'wb') as f:
+        f.write(bytes(data))
+    with Stubber(inventory.asg_client) as asg:
+        asg.add_response('describe_auto_scaling_groups', asg_response([]))
+        assert inventory.cached_inventory() is None
+    assert inventory.stale_tiers == {'master', 'worker'}
+    assert inventory.cached_snapshot == (None, {})
+    assert "hostvars failed its checksum" in capsys.readouterr().err